@@ -1,134 +1,1267 @@
 __author__ = 'sutha75'
 
 import pandas as pd
+import numpy as np
+import xlsxwriter
 import sys, os
+import math
 from datetime import datetime
 import threading
-import PySimpleGUI as sg
 import json
+import hashlib
+import shutil
 import re
+import time
+import queue
+import glob
+import io
+import contextlib
+import multiprocessing
+import cProfile
+import itertools
+import concurrent.futures
+import asyncio
+import ipaddress
+from multiprocessing import shared_memory
+from collections import deque
 
 ## Configs & globals ##
 ReportFileName = datetime.now().strftime("%Y-%m-%d") + '_Account_Movement.xlsx'     # Output file name
-CallCounter = 0
+VectorizedModeMinRows = 100000      # Statements with at least this many rows are balanced with the vectorized batch mode. Smaller ones use the hash engine, which reports progress as it goes
+ParallelModeMinRows = 2000000      # Statements with at least this many rows are matched in parallel across CPU cores, partitioned by amount
+ParallelPartitionsPerWorker = 4     # Amount partitions per worker process in parallel matching mode
+SubsetSumMaxRows = 4                # Subset-sum mode: most rows in one netting group, eg. 4 = one charge against up to three partial reversals
+SubsetSumMaxGroupRows = 40          # Subset-sum mode: contracts with more unmatched rows than this are skipped, as the search grows too fast
+SubsetSumGroupTimeLimit = 0.5       # Subset-sum mode: seconds allowed per contract before moving on to the next one
+SubsetSumParallelMinGroups = 2000   # Subset-sum mode: contracts are searched in a process pool from this many candidate contracts
+SubsetSumMaxStates = 200000         # Subset-sum mode: most combinations indexed in the search for one charge, to bound memory
+StreamingInputMinBytes = 20 * 1024 * 1024   # Input files of at least this size are read in chunks, with matching starting on the early chunks while later ones are still read
+ReadChunkRows = 50000               # Number of rows per chunk in streaming input mode
+MissingCents = np.iinfo(np.int64).min     # Marks an empty (NaN) amount in an int64 cents array. Never matched
+MovementColumns = ['contract number', 'movement total']    # The only input columns used. Streaming input mode reads just these
+MovementFileTypes = ['.xlsx', '.xls', '.csv', '.parquet']   # Input file types picked up in batch mode
+ExcelMaxRows = 1048576              # Excel sheet row limit. Statements with more rows than fit below the report's two header rows get no xlsx report
+UseMatchCache = True                # Save the parsed statement and its pairs, so a rerun on the same or an amended statement doesn't start from scratch
+CacheDir = os.path.join(os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'AcMove')    # Match state cache folder, one sub folder per statement. Per user, so nobody else can plant cache files
+CacheMaxBytes = 512 * 1024 * 1024   # Cache size limit. Least recently used statements are removed beyond this
+BalanceOptions = {                  # Options of the balance() library API and the service mode, with their defaults
+    'report': None,                 # xlsx report file name. None to only return the matches, without writing a report
+    'engine': 'auto',               # Matching engine: 'auto' picks by statement size as on the command line, or 'vectorized', 'stream' or 'parallel'
+    'workers': None,                # Worker processes for parallel and subset-sum matching. None for all CPU cores
+    'useCache': None,               # Use and update the match cache. None for UseMatchCache. Dataframe input never uses the cache
+    'subsetSum': False,             # Also clear one charge against several partial reversals on the same contract
+    'profile': False,               # Save a cProfile dump of each stage next to the report. Needs a report file name
+    'verbose': False}               # Print the run log as it goes, rather than returning it in the result
+ServicePort = 8765                  # Service mode: default local TCP port, when no Unix socket is given
+ServiceMaxQueuedRequests = 32       # Service mode: requests waiting for a free worker beyond this are turned away with HTTP 503
+ServiceMaxRequestBytes = 256 * 1024 * 1024      # Service mode: largest request body accepted, eg. statement rows sent inline as JSON
 
-# Main function
+# Main function, for the command line. eg. C:\>python AcMove.py MovementFile.xls. The GUI runs its balancing jobs through BalancingJobEngine instead
 def main(argv):
-    ## Read configuration Excel file
-    if isinstance(argv, list):
-        guiCall = False             # Called from command line
-        try:
-            movementDataFile = argv[1]
-        except:
-            print('\tERROR: Account movement Excel file invalid!')
+    ## Read the command line
+    try:
+        movementDataFile = argv[1]
+    except:
+        print('\tERROR: Account movement Excel file invalid!')
+        return
+    if movementDataFile == '--serve':                # Local service mode. eg. C:\>python AcMove.py --serve --port=8765 --workers=4, or on Linux $ python AcMove.py --serve --socket=/tmp/acmove.sock
+        MainService(GetOption(argv, '--host', '127.0.0.1'), int(GetOption(argv, '--port', ServicePort)), GetOption(argv, '--socket', None), GetOption(argv, '--workers', None))
+        return
+    forceVectorized = '--vectorized' in argv[2:]     # Optional switch to use the vectorized batch mode regardless of statement size. eg. C:\>python AcMove.py MovementFile.xls --vectorized
+    forceStreaming = '--stream' in argv[2:]          # Optional switch to use streaming input mode regardless of file size. eg. C:\>python AcMove.py MovementFile.csv --stream
+    forceParallel = '--parallel' in argv[2:]         # Optional switch to match in parallel across CPU cores regardless of statement size. eg. C:\>python AcMove.py MovementFile.csv --parallel --workers=8
+    subsetSum = '--subset-sum' in argv[2:]           # Optional switch to also clear one charge against several partial reversals on the same contract. eg. C:\>python AcMove.py MovementFile.xls --subset-sum
+    profile = '--profile' in argv[2:]                # Optional switch to save a cProfile dump of each stage next to the report. eg. C:\>python AcMove.py MovementFile.xls --profile
+    useCache = False if '--no-cache' in argv[2:] else None     # Optional switch to ignore and not update the saved match state. eg. C:\>python AcMove.py MovementFile.xls --no-cache
+    workers = GetOption(argv, '--workers', None)
+    workers = int(workers) if workers else None
+    if IsBatchInput(movementDataFile):               # A directory or a file name pattern balances many statements in one go. eg. C:\>python AcMove.py Statements\*.xls --workers=8
+        if forceParallel:
+            print('\tERROR: --parallel is not available in batch mode, which already balances the statements in parallel')
             return
-    else:
-        guiCall = True              # Called from GUI panel
-        movementDataFile = argv['-FileName-'].Get()     # Get the value from FileName input text box GUI element
+        MainBatch(movementDataFile, workers, GetOption(argv, '--out', '.'), forceVectorized, forceStreaming, subsetSum, useCache, profile)
+        return
+    progress = ProgressTracker(None, PrintProgress, title='\n\tAmount balancing in progress: ')
+
+    BalanceMovementFile(movementDataFile, ReportFileName, progress, forceVectorized, forceStreaming, forceParallel, workers, useCache, profile, subsetSum)
+    return
+    ##### End of main() #####
+
+
+# Function to run the whole balancing pipeline on one movement statement: read, clear zero amounts, match pairs and write the xlsx report.
+#  Used by main() for the command line, by the GUI job worker and by the batch mode workers. Returns a summary dictionary of the run, with 'error' set if it failed.
+#  Each step runs as a RunReport stage. The stage table is printed at the end and saved as a JSON sidecar next to the report
+def BalanceMovementFile(movementDataFile, reportFileName, progress=None, forceVectorized=False, forceStreaming=False, forceParallel=False, workers=None, useCache=None, profile=False, subsetSum=False):
+    return BalanceMovement(movementDataFile, reportFileName, progress, forceVectorized, forceStreaming, forceParallel, workers, useCache, profile, subsetSum)[0]
+
+
+# The balancing pipeline behind BalanceMovementFile() and balance(). Returns (summary, dataframe, MatchState), with None for the dataframe and state if the
+#  input couldn't be read. movementData is a statement file name, or a dataframe with MovementColumns, which skips the match cache and streaming input.
+#  With reportFileName=None no xlsx report and no JSON sidecar are written, and the matches are only returned in the state
+def BalanceMovement(movementData, reportFileName, progress=None, forceVectorized=False, forceStreaming=False, forceParallel=False, workers=None, useCache=None, profile=False, subsetSum=False):
+    isFrameInput = isinstance(movementData, pd.DataFrame)
+    movementDataFile = '<dataframe>' if isFrameInput else movementData
+    runReport = RunReport(movementDataFile, reportFileName, profile)
+    summary = runReport.summary
+    if progress is None:
+        progress = ProgressTracker(None, lambda progressValue: None)    # Nobody to report to, the counters are still used for the summary
+
+    # Look for saved match state of this statement. An unchanged statement skips reading and matching, an amended one only rematches the amounts that changed
+    if useCache is None:
+        useCache = UseMatchCache and not isFrameInput
+    contentHash = cacheEntry = None
+    if useCache:
+        with runReport.Stage('cache lookup'):
+            try:
+                contentHash = FileContentHash(movementDataFile)
+                cacheEntry = LoadMatchCache(movementDataFile)
+            except Exception:
+                cacheEntry = None       # No usable saved state, or the file doesn't exist. In the latter case let the reader below report it
+    cacheHit = cacheEntry is not None and cacheEntry['contentHash'] == contentHash
+
+    # Streaming input mode reads and matches in one go. The vectorized batch, parallel and cache delta modes need the whole column, so they always read the file first
+    try:
+        useStreaming = (forceStreaming or os.path.getsize(movementDataFile) >= StreamingInputMinBytes) and not forceVectorized and not forceParallel and cacheEntry is None and not isFrameInput
+    except OSError:
+        useStreaming = False        # File doesn't exist. Let the reader below report it
 
     ## Read the Movement input data file
     try:
-        df = pd.read_excel(movementDataFile, skiprows=1)
+        if cacheHit:
+            print('--> Statement unchanged since the last run, using the saved match state...')
+            df = cacheEntry['frame']
+            summary['engine'] = 'cache'
+        elif useStreaming:
+            print('--> Reading and balancing movement data in chunks, please wait...')
+            with runReport.Stage('read, zero clearing and matching') as stage:
+                df, clearedFlags, pairs = BalanceMovementStream(movementDataFile, progress)
+                stage['rows'] = len(df)
+            summary['engine'] = 'stream'
+        else:
+            with runReport.Stage('read') as stage:
+                df = CompactMovementFrame(movementData) if isFrameInput else ReadMovementFile(movementDataFile)
+                stage['rows'] = len(df)
     except:
-        print('--> ERROR: Account movement Excel file name incorrect!')
-        if guiCall:
-            argv.write_event_value('-Thread Done-', '')     # Notify GUI that the thread has finished as we are about to return. This is not necessary, but we use this callback method to allow subsequent thread starts
-        return
+        print('\n--> ERROR: Account movement Excel file name incorrect!')
+        summary['error'] = 'Input file could not be read'
+        runReport.Finish()
+        return summary, None, None
 
-    print('--> Balancing movement data, please wait...')
-
-    ## Add ABS formulas to Absolute Amount column
-    rowIdx = 3        # Data start row (when viewed in Excel). i.e. the actual first data row, not the title row.
-    col_C_Data = []
-    for i in range(len(df)):
-        # Required example formula for column C: '=ABS(B3)'
-        col_C_Data.append(f'=ABS($B{str(rowIdx)})')
-        rowIdx += 1
-    df['Absolute Amount'] = col_C_Data
-
-    ## Add a column with title 'Cleared' and load all rows with 'No' values
-    df['Cleared'] = 'No'
-
-    ## Set Cleared flag to Yes for all items with zero amount
-    #   Setting a column value based on value in another column. Ref: https://stackoverflow.com/a/49161313/7251433
-    #   Combining multiple conditions with &-operator.           Ref: https://stackoverflow.com/a/15315507/7251433
-    df.loc[(df['movement total'] > -0.005) & (df['movement total'] < 0.005), 'Cleared'] = 'Yes'     # Because the amount is a float, we use relative comparison to check for near zero
-
-    ## Iterate through the dataframe, find matching amount pairs and clear them
-    if guiCall == False:
-        print('\n\tAmount balancing in progress: ', end='', flush=True) # Printing w/o a newline and flushing it to immediately appear on screen. Ref: https://stackoverflow.com/a/493399/7251433
-
-    # Before starting the double loop, get the total number of uncleared items for progress % calculation
-    xStart = xPrev = df.loc[df['Cleared'] == 'No', 'Cleared'].count()
-    y = z = 0
-    for index, row in df.iterrows():
-        if df.at[index, 'Cleared'] == 'No':  # Fill in only those items that are not yet cleared
-
-            # Monitor remaining uncleared items for progress % calculation
-            x = df.loc[df['Cleared'] == 'No', 'Cleared'].count()    # Get current remaining uncleared items anc check if it has reduced
-            if xPrev != x:
-                xPrev = x
-                y += 2          # If we cleared a pair in the previous loop, then we add 2 for cleared pair
-            else:
-                y += 1          # Otherwise increment 1 for each outer loop pass. Even if don't clear all, the progress % has to be 100% when outer loop ends
-            z += 1              # z counter simply is used to limit GUI progress value notification and nothing to do this progress value calculation itself
-
-            # For each item, find a matching amount. Amounts are both +ve and -ve. So we add two of them to check if they sum to zero, and then clear that pair
-            for index2, row2 in df.iterrows():
-                if df.at[index2, 'Cleared'] == 'No':    # Again, we only consider uncleared items
-                    if IsFloatValueZero( df.at[index, 'movement total'] + df.at[index2, 'movement total'] ):
-                        df.at[index,  'Cleared'] = 'Yes'
-                        df.at[index2, 'Cleared'] = 'Yes'
-                        break
+    if not useStreaming and not cacheHit:
+        print('--> Balancing movement data, please wait...')
 
-            # Update progress %, since the this double loop can take sometime to finish. We calculate progress and report from the outer loop
-            progress = round((float(y) / xStart) * 100)             # When round() is used without digits paramater, it will return a rounded up integer value. Ref: https://docs.python.org/3/library/functions.html#round
-            if guiCall == False:        # Progress printing for command prompt
-                if progress < 100:      # Progress value may be on one value repeated times, eg. 100 may come round a few times due to round() function used above. So we do the printing for 100% separately. If we don't use round() function and int() instead, we may not see 100, due to 99.999999 problem
-                    print('% 3d%%' % progress, end='', flush=True)  # Printing w/o a newline and flushing it to immediately appear on screen. Ref: https://stackoverflow.com/a/493399/7251433
-                else:
-                    print('%d%%' % progress, end='', flush=True)
-                print('\b\b\b\b', end='', flush=True)       # Move back the cursor 4 positions, so that the progress xxx% shown on screen appears in the same location
+    if useStreaming:
+        state = MatchState(df['movement total'], clearedFlags)
+    else:
+        ## Set Cleared flag for all items with zero amount, and convert the amounts to cents once for all matching engines
+        with runReport.Stage('zero clearing', len(df)):
+            state = MatchState(df['movement total'], ZeroAmountMask(df['movement total']))
+
+        ## Find matching amount pairs and clear them
+        progress.totalRows = len(df)
+        progress.Start(openRows=state.unclearedCount)
+        with runReport.Stage('matching', progress.openRows):
+            if cacheHit:
+                pairs = cacheEntry['pairs']
+                progress.Finish(matchedRows=2 * len(pairs))
+            elif cacheEntry is not None:    # Amended statement. Only rematch the amount groups that differ from the saved state
+                cachedAmounts = cacheEntry['frame']['movement total'].to_numpy(dtype=np.float64)
+                pairs, rematchedRows = MatchAmountPairsDelta(state.cents, state.cleared, cachedAmounts, ZeroAmountMask(cacheEntry['frame']['movement total']), cacheEntry['pairs'])
+                progress.Finish(matchedRows=2 * len(pairs))
+                print('\n--> Statement changed since the last run, rematched {:,d} of {:,d} rows'.format(rematchedRows, len(df)), end='')
+                summary['engine'] = 'delta'
+            elif forceParallel or (len(df) >= ParallelModeMinRows and not forceVectorized and workers != 1):     # Parallel and vectorized batch modes match the whole column at once, so progress goes straight to 100%
+                pairs = MatchAmountPairsParallel(state.cents, state.cleared, workers)
+                progress.Finish(matchedRows=2 * len(pairs))
+                summary['engine'] = 'parallel'
+            elif forceVectorized or len(df) >= VectorizedModeMinRows:
+                pairs = MatchAmountPairsVectorized(state.cents, state.cleared)
+                progress.Finish(matchedRows=2 * len(pairs))
+                summary['engine'] = 'vectorized'
             else:
-                # Update progress value to GUI panel by issuing an event
-                if z % 3 == 0 or progress == 100:            # Limit GUI progress to every 3 outer loop pass or if the progress value has reached 100. If we don't allow for 100, GUI progressbar may stop short of fully completing as we skip 2 of 3 loop
-                    argv.write_event_value('-Progress Value-', progress)    # Feedback from this thread to GUI. Ref: https://pysimplegui.readthedocs.io/en/latest/cookbook/#recipe-long-operations-multi-threading
+                pairs = MatchAmountPairs(df['movement total'].tolist(), state.cleared.tolist(), progress)
+                summary['engine'] = 'hash'
+
+    # Save the match state for the next run on this statement
+    if useCache and contentHash is not None and not cacheHit:
+        with runReport.Stage('cache save', len(df)):
+            try:
+                SaveMatchCache(movementDataFile, contentHash, df, pairs)
+            except Exception:
+                print('\n--> WARNING: Could not save match state to the cache')
+
+    ## Clear the matched pairs. Zero amount items were cleared above
+    state.ClearPairs(pairs)
+
+    ## Optionally clear charges netted out by two or more partial reversals on the same contract
+    if subsetSum:
+        with runReport.Stage('subset-sum matching', state.unclearedCount):
+            subsets = MatchSubsetSums(df['contract number'].to_numpy(), state.cents, state.cleared, workers=workers)
+            state.ClearGroups(subsets)
+        subsetRows = sum(len(subset) for subset in subsets)
+        print('\n--> Subset-sum matching cleared {:,d} rows in {:,d} groups'.format(subsetRows, len(subsets)), end='')
+        summary['subsetMatched'] = subsetRows
 
-    print('\n--> Number of amount checks performed: {:,d}'.format(CallCounter))
+    print('\n--> Rows matched in pairs: {:,d}, still unmatched: {:,d}'.format(progress.matchedRows, state.unclearedCount))
+    summary['rows'] = len(df)
+    summary['matched'] = progress.matchedRows
+    summary['unmatched'] = state.unclearedCount
 
-    ## Generate final movement XLSX report
+    ## Generate final movement XLSX report. The Absolute Amount formulas and the Comment column are produced from the state as each row is written
+    if reportFileName is not None and len(df) + 2 > ExcelMaxRows:      # xlsxwriter would silently drop the rows past the sheet limit, so don't write a truncated report
+        print('\n--> ERROR: {:,d} rows do not fit in an Excel sheet (limit {:,d}). No Excel report written.'.format(len(df), ExcelMaxRows - 2))
+        summary['error'] = 'Statement too large for an Excel report'
+    elif reportFileName is not None:
+        try:
+            with runReport.Stage('report writing', len(df)):
+                Create_Movement_Report(df, state.cleared, reportFileName=reportFileName)
+        except:
+            print('\n--> ERROR: Write to Excel output file denied. File may be open!')
+            summary['error'] = 'Report file could not be written'
+        else:
+            print('\n--> Success: Balancing task completed! Check generated Excel report.')
+    runReport.Finish()
+    return summary, df, state
+
+
+# Library API: balance one movement statement without the command line or GUI, eg. from a reconciliation scheduler that has AcMove imported.
+#  movementData is a statement file name, or a dataframe with MovementColumns. options is a dictionary overriding any of BalanceOptions.
+#  Returns the run summary dictionary (same keys as the JSON sidecar) with these added:
+#   'pairs':     NumPy array of shape (n, 2) with the row positions of each matched pair, ordered as MatchAmountPairs() gives them
+#   'cleared':   NumPy bool array, True for each cleared row (zero amounts, pairs and subset-sum groups)
+#   'partners':  NumPy int64 array, the matched row of each row or -1. See MatchState
+#   'output':    the printed run log, unless options['verbose'] is True, in which case it is printed as usual
+#  eg. result = AcMove.balance('Statement.csv', {'report': 'Statement_Report.xlsx', 'subsetSum': True})
+def balance(movementData, options=None):
+    options = dict(BalanceOptions, **(options or {}))
+    unknownOptions = set(options) - set(BalanceOptions)
+    if unknownOptions:
+        raise ValueError('Unknown balance options: ' + ', '.join(sorted(unknownOptions)))
+    if options['engine'] not in ('auto', 'vectorized', 'stream', 'parallel'):
+        raise ValueError(f"Unknown balance engine: {options['engine']}")
+    if isinstance(movementData, pd.DataFrame) and not set(MovementColumns) <= set(movementData.columns):
+        raise ValueError('Movement dataframe needs the columns: ' + ', '.join(MovementColumns))
+
+    capturedOutput = io.StringIO()
+    with contextlib.nullcontext() if options['verbose'] else contextlib.redirect_stdout(capturedOutput):
+        summary, df, state = BalanceMovement(movementData, options['report'], None, options['engine'] == 'vectorized', options['engine'] == 'stream', options['engine'] == 'parallel',
+                                             options['workers'], options['useCache'], options['profile'] and options['report'] is not None, options['subsetSum'])
+    result = dict(summary)
+    if state is None:
+        state = MatchState([])
+    result['pairs'] = state.Pairs()
+    result['cleared'] = state.cleared
+    result['partners'] = state.partners
+    if not options['verbose']:
+        result['output'] = capturedOutput.getvalue()
+    return result
+
+
+# Per-stage instrumentation of a balancing run. Each stage records wall time, CPU time, rows processed and the process memory high-water mark
+#  at its end, and with profile=True also a cProfile dump next to the report. Finish() prints the stage table, which also shows in the GUI
+#  Messages panel, and writes it with the run summary to a JSON sidecar next to the report, eg. 2021-06-30_Account_Movement.json
+class RunReport:
+    def __init__(self, movementDataFile, reportFileName, profile=False):
+        self.reportFileName = reportFileName
+        self.profile = profile
+        self.stages = []
+        self.startTime = time.perf_counter()
+        self.summary = {'file': movementDataFile, 'report': reportFileName, 'engine': None, 'rows': 0, 'matched': 0, 'unmatched': 0, 'seconds': 0.0, 'error': None,
+                        'started': datetime.now().isoformat(timespec='seconds'), 'stages': self.stages}
+
+    # Context manager to run one stage. The stage dictionary is handed out, so rows can be filled in once known. Ref: https://docs.python.org/3/library/contextlib.html#contextlib.contextmanager
+    @contextlib.contextmanager
+    def Stage(self, name, rows=None):
+        stage = {'stage': name, 'rows': rows, 'wallSeconds': 0.0, 'cpuSeconds': 0.0, 'peakMemoryBytes': None}
+        profiler = cProfile.Profile() if self.profile else None
+        startWall = time.perf_counter()
+        startCpu = time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield stage
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            stage['wallSeconds'] = time.perf_counter() - startWall
+            stage['cpuSeconds'] = time.process_time() - startCpu
+            stage['peakMemoryBytes'] = PeakMemoryBytes()
+            if profiler is not None:
+                stage['profile'] = os.path.splitext(self.reportFileName)[0] + '.' + re.sub(r'\W+', '_', name) + '.prof'      # View with eg. C:\>python -m pstats file.prof
+                profiler.dump_stats(stage['profile'])
+            self.stages.append(stage)
+
+    def Finish(self):
+        self.summary['seconds'] = time.perf_counter() - self.startTime
+        print('\n--> Run report ({}):\n'.format(self.summary['engine'] or 'not run'))
+        print('\t{:<34}{:>10}{:>10}{:>12}{:>10}'.format('Stage', 'Wall s', 'CPU s', 'Rows', 'Peak MB'))
+        for stage in self.stages:
+            rowsText = '' if stage['rows'] is None else '{:,d}'.format(stage['rows'])
+            peakText = '' if stage['peakMemoryBytes'] is None else '{:.1f}'.format(stage['peakMemoryBytes'] / 1e6)
+            print('\t{:<34}{:>10.3f}{:>10.3f}{:>12}{:>10}'.format(stage['stage'], stage['wallSeconds'], stage['cpuSeconds'], rowsText, peakText))
+        print('\t{:<34}{:>10.3f}'.format('Total', self.summary['seconds']))
+        if self.reportFileName is None:
+            return      # Library call without a report. The summary is returned to the caller instead
+        try:
+            with open(os.path.splitext(self.reportFileName)[0] + '.json', 'w') as fp:
+                json.dump(self.summary, fp, indent=4, default=str)
+        except OSError:
+            print('\n--> WARNING: Could not write the run report JSON file')
+
+
+# Function to get the memory high-water mark of this process in bytes, or None where it can't be found.
+#  resource is Unix only. On Windows, psutil is used if it is installed. Ref: https://psutil.readthedocs.io/en/latest/#psutil.Process.memory_info
+def PeakMemoryBytes():
     try:
-        Create_Movement_Report(df)
-    except:
-        print('\n--> ERROR: Write to Excel output file denied. File may be open!')
-    else:
-        print('\n--> Success: Balancing task completed! Check generated Excel report.')
+        import resource
+        peakMemory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peakMemory if sys.platform == 'darwin' else peakMemory * 1024     # Bytes on macOS, kilobytes on Linux
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+    except (ImportError, AttributeError):
+        return None
 
-    if guiCall:
-        argv.write_event_value('-Thread Done-', '')  # Notify GUI that the thread has finished as we are about to return. This is not necessary, but we use this callback method to allow subsequent thread starts
-    return
-    ##### End of main() #####
+
+# Function to check if the command line input is a directory or a file name pattern (eg. Statements\*.xls), rather than a single statement.
+#  An existing file is always a single statement, even if its name has pattern characters, eg. 'Statement [June].xls'
+def IsBatchInput(movementInput):
+    if os.path.isfile(movementInput):
+        return False
+    return os.path.isdir(movementInput) or any(c in movementInput for c in '*?[')
+
+
+# Function to get a '--name=value' command line option. Returns the default when the option isn't given
+def GetOption(argv, name, default):
+    for arg in argv[2:]:
+        if arg.startswith(name + '='):
+            return arg[len(name) + 1:]
+    return default
+
+
+# Function to list the movement statements for batch mode, from a directory or a file name pattern. Ref: https://docs.python.org/3/library/glob.html
+def FindMovementFiles(movementInput):
+    if os.path.isdir(movementInput):
+        movementInput = os.path.join(movementInput, '*')
+    return sorted(f for f in glob.glob(movementInput) if os.path.isfile(f) and os.path.splitext(f)[1].lower() in MovementFileTypes)
+
+
+# Function to make the report file name for a statement in batch mode, eg. 2021-06-30_Branch042_xls_Account_Movement.xlsx, so each input gets its own report.
+#  The input file type is part of the name, so eg. Branch042.csv and Branch042.parquet in the same folder don't write over each other's report
+def BatchReportFileName(movementDataFile, outputDir):
+    fileStem, fileExt = os.path.splitext(os.path.basename(movementDataFile))
+    return os.path.join(outputDir, datetime.now().strftime("%Y-%m-%d") + '_' + fileStem + '_' + fileExt.lstrip('.').lower() + '_Account_Movement.xlsx')
+
+
+# Batch mode worker. Runs in a separate process from the pool, so its print output is captured rather than mixed with the other workers' output
+def BalanceBatchFile(movementDataFile, reportFileName, forceVectorized, forceStreaming, subsetSum=False, useCache=None, profile=False):
+    capturedOutput = io.StringIO()
+    with contextlib.redirect_stdout(capturedOutput):    # Ref: https://docs.python.org/3/library/contextlib.html#contextlib.redirect_stdout
+        try:
+            summary = BalanceMovementFile(movementDataFile, reportFileName, None, forceVectorized, forceStreaming, workers=1, useCache=useCache, profile=profile, subsetSum=subsetSum)     # One core per file, the pool already keeps all cores busy
+        except Exception as batchError:
+            summary = {'file': movementDataFile, 'report': reportFileName, 'rows': 0, 'matched': 0, 'unmatched': 0, 'seconds': 0.0, 'error': repr(batchError)}
+    summary['output'] = capturedOutput.getvalue()
+    return summary
 
 
-# Function to check if a given value of type float is near zero
-def IsFloatValueZero(floatValue):
-    global CallCounter
-    CallCounter += 1
-    if floatValue < 0.001 and floatValue > -0.001:
+# Batch mode: balance every statement from a directory or a file name pattern in parallel, using a process pool. One report per input file goes to outputDir.
+#  Prints each file as it completes and ends with an aggregate summary. Ref: https://docs.python.org/3/library/concurrent.futures.html#processpoolexecutor
+def MainBatch(movementInput, workers=None, outputDir='.', forceVectorized=False, forceStreaming=False, subsetSum=False, useCache=None, profile=False):
+    movementFiles = FindMovementFiles(movementInput)
+    if not movementFiles:
+        print(f'\tERROR: No movement statements found in {movementInput}')
+        return []
+    workers = int(workers) if workers else min(len(movementFiles), os.cpu_count() or 1)
+    os.makedirs(outputDir, exist_ok=True)
+    print(f'--> Balancing {len(movementFiles)} movement statements with {workers} workers, please wait...\n')
+
+    batchStart = time.perf_counter()
+    summaries = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(BalanceBatchFile, f, BatchReportFileName(f, outputDir), forceVectorized, forceStreaming, subsetSum, useCache, profile) for f in movementFiles]
+        for future in concurrent.futures.as_completed(futures):
+            summary = future.result()
+            summaries.append(summary)
+            status = 'ERROR: ' + summary['error'] if summary['error'] else 'Ok'
+            print('\t[{:{w}d}/{:d}] {} - {}'.format(len(summaries), len(movementFiles), os.path.basename(summary['file']), status, w=len(str(len(movementFiles)))))
+
+    # Aggregate summary, in input file order
+    fileOrder = {f: i for i, f in enumerate(movementFiles)}
+    summaries.sort(key=lambda s: fileOrder[s['file']])
+    nameWidth = max(len(os.path.basename(s['file'])) for s in summaries)
+    print('\n--> Batch summary:\n')
+    print('\t{:<{w}}  {:>10}  {:>10}  {:>9}  {}'.format('Statement', 'Rows', 'Unmatched', 'Seconds', 'Status', w=nameWidth))
+    for s in summaries:
+        print('\t{:<{w}}  {:>10,d}  {:>10,d}  {:>9.2f}  {}'.format(os.path.basename(s['file']), s['rows'], s['unmatched'], s['seconds'], s['error'] or 'Ok', w=nameWidth))
+    failedCount = sum(1 for s in summaries if s['error'])
+    print('\n\tTotal: {:,d} statements, {:,d} rows, {:,d} unmatched, {:,d} failed. Elapsed {:.2f}s (sum of file runtimes {:.2f}s)'.format(
+        len(summaries), sum(s['rows'] for s in summaries), sum(s['unmatched'] for s in summaries), failedCount,
+        time.perf_counter() - batchStart, sum(s['seconds'] for s in summaries)))
+    return summaries
+
+
+# Service mode: a long running local HTTP service that keeps the imports loaded and a pool of warm worker processes, so a scheduler can send balancing
+#  requests without paying the startup cost each time. Listens on a local TCP port, or on a Unix socket where supported. Requests run concurrently on
+#  the bounded worker pool, and are turned away with HTTP 503 when more than ServiceMaxQueuedRequests are waiting. Endpoints:
+#   GET  /health   -> {"status": "ok", "workers": 4, "running": 1, "waiting": 0}
+#   POST /balance  -> JSON body {"file": "Statement.csv"} or {"rows": {"contract number": [...], "movement total": [...]}}, plus optional
+#                     "options" (see BalanceOptions) and "pairs" (return the matched pairs, by default only when no report is written).
+#                     Returns the run summary as JSON, with "pairs" as a list of [firstRowPos, secondRowPos] and "unclearedRows" when asked for.
+#  eg. $ curl -X POST localhost:8765/balance -d '{"file": "Statement.csv", "options": {"report": "Statement_Report.xlsx"}}'
+#      $ curl --unix-socket /tmp/acmove.sock -X POST localhost/balance -d '{"file": "Statement.csv"}'
+# There is no authentication, and "file" and "report" take any path the service user can read or write. So the service only listens on a loopback
+#  address, and a Unix socket should be kept in a folder only trusted users can reach
+def MainService(host='127.0.0.1', port=ServicePort, socketPath=None, workers=None):
+    if not socketPath and not IsLoopbackHost(host):
+        print(f'\tERROR: The balancing service only listens on this computer (eg. 127.0.0.1 or localhost), not on {host}')
+        return
+    workers = int(workers) if workers else os.cpu_count() or 1
+    service = BalancingService(workers)
+    try:
+        asyncio.run(service.Serve(host, port, socketPath))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.Shutdown()
+        if socketPath and os.path.exists(socketPath):
+            os.remove(socketPath)
+        print('\n--> Balancing service stopped')
+
+
+# Function to check if a host name or address only reaches this computer
+def IsLoopbackHost(host):
+    if host == 'localhost':
         return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False        # Other host names may resolve to an outside address
+
+
+# Service mode server. The asyncio loop only parses requests and waits on the worker pool, so slow balancing runs never block other connections
+class BalancingService:
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        self.runningRequests = 0
+
+    async def Serve(self, host, port, socketPath=None):
+        # Warm up the worker processes, so the first requests don't wait on process start and the pandas import
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.executor, os.getpid) for _ in range(self.workers)])
+        if socketPath:
+            if os.path.exists(socketPath):
+                os.remove(socketPath)       # Left behind by an earlier run that didn't shut down cleanly
+            server = await asyncio.start_unix_server(self.HandleConnection, path=socketPath)     # Unix only. Ref: https://docs.python.org/3/library/asyncio-stream.html#asyncio.start_unix_server
+            print(f'--> Balancing service listening on {socketPath} with {self.workers} workers. Press Ctrl+C to stop')
+        else:
+            server = await asyncio.start_server(self.HandleConnection, host, port)
+            print(f'--> Balancing service listening on http://{host}:{port} with {self.workers} workers. Press Ctrl+C to stop')
+        async with server:
+            await server.serve_forever()
+
+    # One HTTP request per connection. Ref: https://docs.python.org/3/library/asyncio-stream.html#tcp-echo-server-using-streams
+    async def HandleConnection(self, reader, writer):
+        try:
+            try:
+                method, path, body = await ReadHttpRequest(reader)
+                status, response = await self.Route(method, path, body)
+            except (ValueError, asyncio.IncompleteReadError) as requestError:
+                status, response = 400, {'error': str(requestError)}
+            except Exception as serviceError:     # Anything else, eg. RuntimeError from a worker pool that was shut down, still gets a reply
+                status, response = 500, {'error': repr(serviceError)}
+            responseBody = json.dumps(response, default=str).encode('utf-8')
+            writer.write(f'HTTP/1.1 {status} {HttpStatusText.get(status, "")}\r\nContent-Type: application/json\r\nContent-Length: {len(responseBody)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + responseBody)
+            await writer.drain()
+        except ConnectionError:
+            pass        # Client went away before the reply
+        finally:
+            writer.close()
+
+    async def Route(self, method, path, body):
+        path = path.split('?')[0]
+        if method == 'GET' and path == '/health':
+            return 200, {'status': 'ok', 'workers': self.workers, 'running': min(self.runningRequests, self.workers), 'waiting': max(0, self.runningRequests - self.workers)}
+        if path != '/balance':
+            return 404, {'error': f'Unknown path {path}'}
+        if method != 'POST':
+            return 405, {'error': 'Use POST for /balance'}
+        if self.runningRequests >= self.workers + ServiceMaxQueuedRequests:
+            return 503, {'error': 'Too many balancing requests waiting, try again later'}
+        request = json.loads(body or b'{}')         # json.JSONDecodeError is a ValueError, so a bad body gives a 400 reply
+        if not isinstance(request, dict):
+            return 400, {'error': 'Request body must be a JSON object'}
+        if not isinstance(request.get('options', {}), dict):
+            return 400, {'error': '"options" must be a JSON object'}
+        self.runningRequests += 1
+        executor = self.executor
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, BalanceServiceRequest, request)
+        except concurrent.futures.BrokenExecutor:     # BrokenProcessPool, for a process pool
+            # A worker process died, eg. out of memory on a huge statement, and the pool can't take more work. Start a new pool for the next requests.
+            #  Other requests running on the same pool fail the same way, so only the first one to get here replaces it
+            if self.executor is executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+            return 500, {'error': 'Balancing worker process stopped unexpectedly, eg. out of memory. Worker pool restarted'}
+        finally:
+            self.runningRequests -= 1
+
+    def Shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Reason phrases for the status codes the service replies with
+HttpStatusText = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 422: 'Unprocessable Entity', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+# Function to read one HTTP/1.1 request from an asyncio stream. Returns (method, path, body bytes). Only what the service needs: no chunked bodies, no keep-alive
+async def ReadHttpRequest(reader):
+    requestLine = (await reader.readline()).decode('latin-1').split()
+    if len(requestLine) != 3:
+        raise ValueError('Malformed HTTP request line')
+    headers = {}
+    while True:
+        headerLine = await reader.readline()
+        if headerLine in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = headerLine.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    bodyLength = int(headers.get('content-length', 0))
+    if bodyLength > ServiceMaxRequestBytes:
+        raise ValueError(f'Request body over {ServiceMaxRequestBytes:,d} bytes')
+    body = await reader.readexactly(bodyLength) if bodyLength > 0 else b''
+    return requestLine[0].upper(), requestLine[1], body
+
+
+# Service mode worker, runs in a pool process. Balances one request with balance() and returns (HTTP status, JSON ready reply).
+#  Matching inside a request uses one core by default, as the pool already runs requests side by side
+def BalanceServiceRequest(request):
+    try:
+        options = dict({'workers': 1}, **request.get('options', {}))
+        if 'rows' in request:
+            movementData = pd.DataFrame(request['rows'])
+        elif 'file' in request:
+            movementData = request['file']
+        else:
+            return 400, {'error': 'Request needs a "file" or "rows"'}
+        result = balance(movementData, options)
+    except ValueError as requestError:
+        return 400, {'error': str(requestError)}
+    except Exception as balanceError:
+        return 500, {'error': repr(balanceError)}
+
+    reply = {k: v for k, v in result.items() if k not in ('pairs', 'cleared', 'partners')}
+    if request.get('pairs', options.get('report') is None):
+        reply['pairs'] = result['pairs'].tolist()
+        reply['unclearedRows'] = np.flatnonzero(~result['cleared']).tolist()
+    return (422 if result['error'] else 200), reply      # Input couldn't be read or report couldn't be written
+
+
+# Compact match state of a statement, kept in flat NumPy arrays next to the dataframe rather than as extra dataframe columns:
+#  cents:     int64 amount in cents per row, MissingCents for empty amounts. All matching engines except the hash engine work on this
+#  cleared:   bool per row, True for zero amounts and matched rows
+#  partners:  int64 per row, the row it was matched with, or -1. Rows cleared by subset-sum matching point to the next row of their group, in a ring
+# At 17 bytes per row, this is a fraction of the 'Yes'/'No' and formula string columns it replaces, and copying the arrays is enough to snapshot it.
+#  The 'Ok'/'Unmatched' comments and the ABS formulas are only produced by Create_Movement_Report(), one row at a time
+class MatchState:
+    def __init__(self, amounts, clearedFlags=None):
+        self.cents = MovementCents(amounts)
+        self.cleared = np.zeros(len(self.cents), dtype=bool) if clearedFlags is None else np.array(clearedFlags, dtype=bool)
+        self.partners = np.full(len(self.cents), -1, dtype=np.int64)
+
+    @property
+    def unclearedCount(self):
+        return int(len(self.cleared) - self.cleared.sum())
+
+    # Clear matched pairs, as returned by the pair-matching engines
+    def ClearPairs(self, pairs):
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        self.partners[pairs[:, 0]] = pairs[:, 1]
+        self.partners[pairs[:, 1]] = pairs[:, 0]
+        self.cleared[pairs.reshape(-1)] = True
+
+    # Function to get the matched pairs back from the partner array, as a NumPy array of shape (n, 2) ordered by second row like MatchAmountPairs().
+    #  Subset-sum groups are left out, since their rows don't point at each other
+    def Pairs(self):
+        rowPos = np.arange(len(self.partners))
+        firstRows = np.flatnonzero((self.partners > rowPos) & (self.partners[np.maximum(self.partners, 0)] == rowPos))
+        secondRows = self.partners[firstRows]
+        pairOrder = np.argsort(secondRows, kind='stable')
+        return np.column_stack((firstRows[pairOrder], secondRows[pairOrder])).astype(np.int64)
+
+    # Clear netting groups, as returned by MatchSubsetSums()
+    def ClearGroups(self, groups):
+        for group in groups:
+            group = np.asarray(group, dtype=np.int64)
+            self.partners[group] = np.roll(group, -1)
+            self.cleared[group] = True
+
+
+# Function to convert a column of amounts to an int64 NumPy array of cents, with MissingCents for empty amounts
+def MovementCents(amounts):
+    amounts = np.asarray(amounts, dtype=np.float64)
+    cents = np.full(len(amounts), MissingCents, dtype=np.int64)
+    present = ~np.isnan(amounts)
+    cents[present] = np.copysign(np.floor(np.abs(amounts[present]) * 100 + 0.5), amounts[present])     # Half cents round away from zero, same as AmountToCents()
+    return cents
+
+
+# Function to flag the items with zero amount. Returns a boolean NumPy array, True for near zero amounts
+#  Combining multiple conditions with &-operator. Ref: https://stackoverflow.com/a/15315507/7251433
+def ZeroAmountMask(amounts):
+    return ((amounts > -0.005) & (amounts < 0.005)).to_numpy(dtype=bool, copy=True)     # Because the amount is a float, we use relative comparison to check for near zero
+
+
+# Function to read the whole movement statement in one go. Only MovementColumns are read, with compact dtypes. Excel statements have a title row
+#  above the column headers, which is skipped. CSV statements may or may not have it
+def ReadMovementFile(movementDataFile):
+    fileExt = os.path.splitext(movementDataFile)[1].lower()
+    if fileExt == '.csv':
+        return CompactMovementFrame(pd.read_csv(movementDataFile, skiprows=CsvTitleRows(movementDataFile), usecols=MovementColumns))
+    if fileExt == '.parquet':
+        return CompactMovementFrame(pd.read_parquet(movementDataFile, columns=MovementColumns))
+    return CompactMovementFrame(pd.read_excel(movementDataFile, skiprows=1, usecols=MovementColumns))
+
+
+# Function to read the movement statement in row chunks of ReadChunkRows rows. A generator yielding dataframes with MovementColumns only.
+#  .xlsx is streamed with openpyxl read-only mode, .xls one column slice at a time with xlrd, CSV with the pandas chunked reader and Parquet by record batch
+def ReadMovementChunks(movementDataFile, chunkRows=ReadChunkRows):
+    fileExt = os.path.splitext(movementDataFile)[1].lower()
+    if fileExt == '.csv':
+        csvReader = pd.read_csv(movementDataFile, skiprows=CsvTitleRows(movementDataFile), usecols=MovementColumns, chunksize=chunkRows)
+        with csvReader:
+            for chunk in csvReader:
+                yield CompactMovementFrame(chunk)
+    elif fileExt == '.parquet':
+        import pyarrow.parquet      # Optional dependency, only needed for Parquet input
+        for batch in pyarrow.parquet.ParquetFile(movementDataFile).iter_batches(batch_size=chunkRows, columns=MovementColumns):
+            yield CompactMovementFrame(batch.to_pandas())
+    elif fileExt == '.xls':
+        import xlrd
+        workbook = xlrd.open_workbook(movementDataFile, on_demand=True)
+        try:
+            sheet = workbook.sheet_by_index(0)
+            headers = sheet.row_values(1)       # Row 1 is the title row, column headers are on row 2
+            colIdx = [headers.index(colName) for colName in MovementColumns]
+            for startRow in range(2, sheet.nrows, chunkRows):
+                endRow = min(startRow + chunkRows, sheet.nrows)
+                chunk = {colName: [XlsCellValue(cellValue) for cellValue in sheet.col_values(col, startRow, endRow)] for colName, col in zip(MovementColumns, colIdx)}
+                yield CompactMovementFrame(pd.DataFrame(chunk))
+        finally:
+            workbook.release_resources()
     else:
-        return False
+        import openpyxl
+        workbook = openpyxl.load_workbook(movementDataFile, read_only=True, data_only=True)     # Read-only mode streams the rows instead of loading the whole sheet. Ref: https://openpyxl.readthedocs.io/en/stable/optimized.html
+        try:
+            rows = workbook.worksheets[0].iter_rows(min_row=2, values_only=True)    # Skip the title row
+            headers = list(next(rows))
+            colIdx = [headers.index(colName) for colName in MovementColumns]
+            chunk = []
+            for row in rows:
+                chunk.append([row[col] if col < len(row) else None for col in colIdx])
+                if len(chunk) == chunkRows:
+                    yield CompactMovementFrame(pd.DataFrame(chunk, columns=MovementColumns))
+                    chunk = []
+            if chunk:
+                yield CompactMovementFrame(pd.DataFrame(chunk, columns=MovementColumns))
+        finally:
+            workbook.close()
+
+
+# Function to convert an xlrd cell value the way pandas.read_excel() does. xlrd gives every number as a float and '' for empty cells, so whole numbers
+#  become int (eg. contract number 364774.0 -> 364774) and empty cells None. Streamed and whole-file reads of an .xls then give the same frame
+def XlsCellValue(cellValue):
+    if cellValue == '':
+        return None
+    if isinstance(cellValue, float) and cellValue.is_integer():
+        return int(cellValue)
+    return cellValue
+
+
+# Function to run ReadMovementChunks() on a background thread, so parsing of later chunks goes on while earlier chunks are being matched.
+#  The queue is bounded, so the reader can't run too far ahead and fill up memory. Any read error is passed through and raised to the caller
+def ReadMovementChunksInBackground(movementDataFile, chunkRows=ReadChunkRows, maxQueuedChunks=4):
+    chunkQueue = queue.Queue(maxsize=maxQueuedChunks)
+    stopReading = threading.Event()
+    endOfFile = object()            # Marker put on the queue after the last chunk
+
+    def Reader():
+        try:
+            for chunk in ReadMovementChunks(movementDataFile, chunkRows):
+                while not stopReading.is_set():
+                    try:
+                        chunkQueue.put(chunk, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stopReading.is_set():
+                    return
+            chunkQueue.put(endOfFile)
+        except Exception as readError:
+            chunkQueue.put(readError)
+
+    readerThread = threading.Thread(target=Reader, daemon=True)
+    readerThread.start()
+    try:
+        while True:
+            chunk = chunkQueue.get()
+            if chunk is endOfFile:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        stopReading.set()           # Let the reader thread finish if the caller stopped early
+
+
+# Function to read and balance a movement statement chunk by chunk, with matching starting as soon as the first chunk has been read.
+#  Returns the whole dataframe, the cleared flags array (zero amounts only) and the matched pairs, same as the non streaming path in main()
+def BalanceMovementStream(movementDataFile, progress=None):
+    if progress is not None:
+        progress.totalRows = EstimateMovementRows(movementDataFile)
+        progress.Start(openRows=0)
+    matcher = PairMatcher()
+    chunks = []
+    zeroFlags = []
+    for chunk in ReadMovementChunksInBackground(movementDataFile):
+        chunkZeroFlags = ZeroAmountMask(chunk['movement total'])
+        if progress is not None:
+            progress.openRows += len(chunk) - int(chunkZeroFlags.sum())
+        matcher.Feed(chunk['movement total'].tolist(), chunkZeroFlags.tolist(), progress)
+        chunks.append(chunk)
+        zeroFlags.append(chunkZeroFlags)
+    if chunks:
+        df = pd.concat(chunks, ignore_index=True)
+        clearedFlags = np.concatenate(zeroFlags)
+    else:
+        df = CompactMovementFrame(pd.DataFrame(columns=MovementColumns))
+        clearedFlags = np.zeros(0, dtype=bool)
+    df['contract number'] = df['contract number'].astype('category')    # Contract numbers repeat across movements, so a category column is much smaller than Python objects
+    if progress is not None:
+        progress.totalRows = len(df)
+        progress.Finish(2 * len(matcher.pairs))
+    return df, clearedFlags, matcher.pairs
+
+
+# Function to reduce a frame to MovementColumns with compact dtypes. Non numeric amounts become NaN and are never matched
+def CompactMovementFrame(frame):
+    frame = frame[MovementColumns].copy()
+    frame['movement total'] = pd.to_numeric(frame['movement total'], errors='coerce').astype(np.float64)    # Kept at float64, since float32 can't hold cents exactly on large amounts
+    return frame
+
+
+# Function to find how many rows to skip in a CSV statement. Exported CSVs may keep the Excel title row above the column headers, or may not
+def CsvTitleRows(movementDataFile):
+    with open(movementDataFile, 'r', newline='') as fp:
+        firstLine = fp.readline()
+    return 0 if 'movement total' in firstLine else 1
+
+
+# Function to estimate the number of data rows from the file metadata, without reading the data. Returns None where the row count isn't cheap to find (CSV)
+def EstimateMovementRows(movementDataFile):
+    fileExt = os.path.splitext(movementDataFile)[1].lower()
+    try:
+        if fileExt == '.parquet':
+            import pyarrow.parquet
+            return pyarrow.parquet.ParquetFile(movementDataFile).metadata.num_rows
+        if fileExt == '.xls':
+            import xlrd
+            workbook = xlrd.open_workbook(movementDataFile, on_demand=True)
+            rowCount = workbook.sheet_by_index(0).nrows - 2
+            workbook.release_resources()
+            return max(0, rowCount)
+        if fileExt == '.xlsx':
+            import openpyxl
+            workbook = openpyxl.load_workbook(movementDataFile, read_only=True)
+            rowCount = workbook.worksheets[0].max_row      # Taken from the sheet dimension tag, may be None if the file doesn't have one
+            workbook.close()
+            return None if rowCount is None else max(0, rowCount - 2)
+    except Exception:
+        pass
+    return None
+
+
+# Progress tracking for the balancing steps. Keeps running counters of processed, matched and remaining rows, so the progress % is known at any time
+#  without rescanning the Cleared column. The reporter function gets the progress % as an integer, but only when it has moved on by at least minStep %
+#  or minInterval seconds have passed since the last report, and always once on completion. So reporting stays cheap even on 1M-row statements.
+#  Both the command prompt printer and the GUI progress bar event are driven from here.
+class ProgressTracker:
+    UpdateEveryRows = 1024          # Matching engines call Update() once per this many rows. The throttle below then decides if the reporter is called
+
+    def __init__(self, totalRows, reporter, minStep=1, minInterval=0.25, title=None):
+        self.totalRows = totalRows
+        self.reporter = reporter
+        self.title = title          # Optional text printed just before the first report, eg. a label for the command prompt progress %
+        self.minStep = minStep
+        self.minInterval = minInterval
+        self.Start(openRows=totalRows)
+
+    # Reset the counters. openRows is the number of uncleared rows when matching starts
+    def Start(self, openRows):
+        self.processedRows = 0
+        self.matchedRows = 0
+        self.openRows = openRows
+        self.lastProgress = None
+        self.lastReportTime = 0.0
+
+    @property
+    def remainingRows(self):
+        return self.openRows - self.matchedRows
+
+    @property
+    def progressValue(self):
+        if self.totalRows is None:      # Total not known yet, eg. while streaming a CSV file. Progress only shows on completion
+            return 0
+        if self.totalRows <= 0:
+            return 100
+        return min(100, (self.processedRows * 100) // self.totalRows)    # Integer division, so 100% is only shown once all rows are really done
+
+    def Update(self, processedRows, matchedRows):
+        self.processedRows = processedRows
+        self.matchedRows = matchedRows
+        progressValue = self.progressValue
+        if self.lastProgress is None or progressValue >= self.lastProgress + self.minStep:
+            self._Report(progressValue)
+        elif progressValue != self.lastProgress and time.monotonic() - self.lastReportTime >= self.minInterval:
+            self._Report(progressValue)
+
+    def Finish(self, matchedRows):
+        self.processedRows = self.totalRows
+        self.matchedRows = matchedRows
+        if self.lastProgress != 100:        # The last Update() may have already reported 100%
+            self._Report(100)
+
+    def _Report(self, progressValue):
+        if self.title is not None:
+            print(self.title, end='', flush=True)     # Printing w/o a newline and flushing it to immediately appear on screen. Ref: https://stackoverflow.com/a/493399/7251433
+            self.title = None
+        self.lastProgress = progressValue
+        self.lastReportTime = time.monotonic()
+        self.reporter(progressValue)
+
+
+# Progress reporter for the command prompt. Prints the progress % w/o a newline and moves the cursor back, so the value appears in the same location
+def PrintProgress(progressValue):
+    if progressValue < 100:
+        print('% 3d%%' % progressValue, end='', flush=True)    # Printing w/o a newline and flushing it to immediately appear on screen. Ref: https://stackoverflow.com/a/493399/7251433
+    else:
+        print('%d%%' % progressValue, end='', flush=True)
+    print('\b\b\b\b', end='', flush=True)       # Move back the cursor 4 positions, so that the progress xxx% shown on screen appears in the same location
+
+
+# Function to convert a float amount to integer cents, so amounts can be compared exactly and used as dictionary keys.
+#  Rounded first, since float multiplication alone may give eg. 1.15 * 100 = 114.99999999999999. Half cents round away from zero rather than to even,
+#  so a ±0.005 amount left over by zero clearing keeps its sign and only nets against its negation. Returns None for NaN (empty cell) amounts
+def AmountToCents(amount):
+    if amount != amount:        # NaN is the only value not equal to itself. Ref: https://stackoverflow.com/a/944712
+        return None
+    return int(math.copysign(math.floor(abs(amount) * 100 + 0.5), amount))
+
+
+# Pair-matching engine. Finds pairs of uncleared amounts that net to zero and returns them as a list of (firstRowPos, secondRowPos) tuples.
+#  amounts:          list of 'movement total' values, in row order
+#  clearedFlags:     list of booleans, True for rows already cleared (eg. zero amounts). Those rows are skipped. Not modified
+#  progress:         optional ProgressTracker, updated every ProgressTracker.UpdateEveryRows rows and finished at the end
+# Rows are visited once in order, keeping a hash index of open (still unmatched) rows keyed by amount in cents. Each row looks up the index for its
+#  negated amount in O(1) and pairs with the earliest open row found there, otherwise it becomes an open row itself. This gives exactly the same
+#  pairs as the earlier double loop, where each uncleared row was paired with the first following uncleared row holding the negated amount.
+# Amounts are compared exact to the cent, rather than within ±0.001 as the double loop did. The two only differ on amounts with fractions of a cent
+def MatchAmountPairs(amounts, clearedFlags=None, progress=None):
+    matcher = PairMatcher()
+    matcher.Feed(amounts, clearedFlags, progress)
+    if progress is not None:
+        progress.Finish(2 * len(matcher.pairs))     # Make sure we always finish on 100%
+    return matcher.pairs
+
+
+# Incremental form of the pair-matching engine used by MatchAmountPairs(). Rows can be fed in consecutive chunks, eg. while a large statement is still
+#  being read, and the open row index is carried over from one chunk to the next. Row positions in pairs count from the first row of the first chunk.
+class PairMatcher:
+    def __init__(self):
+        self.openRows = {}          # Amount in cents -> deque of open row positions, oldest first
+        self.pairs = []
+        self.rowCount = 0           # Number of rows fed so far, i.e. the position of the next row
+
+    # Match the next chunk of rows. Parameters are the same as MatchAmountPairs(), but the progress tracker is only updated, not finished
+    def Feed(self, amounts, clearedFlags=None, progress=None):
+        if clearedFlags is None:
+            clearedFlags = [False] * len(amounts)
+        openRows = self.openRows    # Local names, as attribute lookups inside the row loop add up on large statements
+        pairs = self.pairs
+        firstRowPos = self.rowCount
+        rowsToUpdate = ProgressTracker.UpdateEveryRows
+        for chunkPos, amount in enumerate(amounts):
+            if not clearedFlags[chunkPos]:
+                cents = AmountToCents(amount)
+                if cents is not None:       # Empty amounts can never be matched
+                    waiting = openRows.get(-cents)
+                    if waiting:
+                        pairs.append((waiting.popleft(), firstRowPos + chunkPos))
+                    else:
+                        openRows.setdefault(cents, deque()).append(firstRowPos + chunkPos)
+            rowsToUpdate -= 1
+            if rowsToUpdate == 0:       # Countdown instead of a modulo, to keep the per-row cost down
+                rowsToUpdate = ProgressTracker.UpdateEveryRows
+                if progress is not None:
+                    progress.Update(firstRowPos + chunkPos + 1, 2 * len(pairs))
+        self.rowCount += len(amounts)
+        if progress is not None:
+            progress.Update(self.rowCount, 2 * len(pairs))
+
+
+# Vectorized batch version of MatchAmountPairs() for very large statements. Takes the same parameters and returns the same pairs, in the same order,
+#  but as a NumPy array of shape (n, 2) and without any per-row Python work. No progress callback, as the whole column is matched in a handful of array operations.
+# Rows are grouped by absolute amount in cents. Inside each group, the k-th negative occurrence pairs with the k-th positive occurrence, which is the
+#  same pairing the hash engine gives when it always takes the earliest open row. The occurrence rank is found with a stable sort and a cumulative count.
+def MatchAmountPairsVectorized(amounts, clearedFlags=None):
+    rowPos, cents = OpenAmountCents(amounts, clearedFlags)
+    return MatchCentsVectorized(rowPos, cents)
+
+
+# Function to pick the open rows for matching. Returns the row positions of rows that are not cleared and not empty, and their amounts in integer cents.
+#  amounts can be float amounts, or an int64 cents array from MovementCents() (eg. MatchState.cents), which saves converting them again
+def OpenAmountCents(amounts, clearedFlags=None):
+    cents = amounts if isinstance(amounts, np.ndarray) and amounts.dtype == np.int64 else MovementCents(amounts)
+    openMask = cents != MissingCents        # Empty amounts can never be matched
+    if clearedFlags is not None:
+        openMask &= ~np.asarray(clearedFlags, dtype=bool)
+    rowPos = np.flatnonzero(openMask)
+    return rowPos, cents[rowPos]
+
+
+# Vectorized matching on open rows already converted to cents, as given by OpenAmountCents(). rowPos must be in ascending order.
+#  Returns the pairs as a NumPy array of shape (n, 2), ordered as MatchAmountPairs() would give them
+def MatchCentsVectorized(rowPos, cents):
+    if len(rowPos) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    groupKey = np.abs(cents) * 2 + (cents > 0)                 # Group code: absolute cents, with the lowest bit telling +ve (1) from -ve or zero (0) rows
+
+    # Stable sort by group code, so rows keep their original order inside each group. Ref: https://numpy.org/doc/stable/reference/generated/numpy.argsort.html
+    order = np.argsort(groupKey, kind='stable')
+    sortedRows = rowPos[order]
+    sortedKey = groupKey[order]
+    groupStart = np.flatnonzero(np.r_[True, sortedKey[1:] != sortedKey[:-1]])
+    groupSize = np.diff(np.r_[groupStart, len(sortedKey)])
+    groupCode = sortedKey[groupStart]
+    groupIdx = np.repeat(np.arange(len(groupStart)), groupSize)
+    rank = np.arange(len(sortedKey)) - groupStart[groupIdx]   # Occurrence number of each row inside its own group (cumulative count)
+
+    # Number of occurrences in the opposite sign group for the same absolute amount, or 0 if there are none
+    oppositeCode = groupCode ^ 1
+    oppositeIdx = np.minimum(np.searchsorted(groupCode, oppositeCode), len(groupCode) - 1)
+    oppositeSize = np.where(groupCode[oppositeIdx] == oppositeCode, groupSize[oppositeIdx], 0)
+
+    # Zero cent rows have no sign, they simply pair with the next zero cent row. Other rows are matched if their rank is below the opposite group's size
+    isZero = sortedKey == 0
+    matched = np.where(isZero, rank < (groupSize[groupIdx] // 2) * 2, rank < oppositeSize[groupIdx])
+
+    # Both sign lists below are ordered by amount then rank, and hold the same number of rows per amount, so they line up pair by pair
+    zeroRows = sortedRows[matched & isZero]
+    negativeRows = sortedRows[matched & ~isZero & (sortedKey % 2 == 0)]
+    positiveRows = sortedRows[matched & (sortedKey % 2 == 1)]
+    firstRows = np.r_[zeroRows[0::2], np.minimum(negativeRows, positiveRows)]
+    secondRows = np.r_[zeroRows[1::2], np.maximum(negativeRows, positiveRows)]
+    pairOrder = np.argsort(secondRows, kind='stable')        # Same order as MatchAmountPairs(), which records a pair when its second row is reached
+    return np.column_stack((firstRows[pairOrder], secondRows[pairOrder])).astype(np.int64)
+
+
+# Delta version of MatchAmountPairsVectorized() for an amended statement, given the amounts, cleared flags and pairs saved from the previous run.
+#  Pairing only ever happens inside a group of rows with the same absolute amount, and only depends on the order of +ve and -ve rows in that group.
+#  So groups whose sign sequence is unchanged keep their saved pairs, moved to the new row positions, and only the other groups are rematched.
+#  Returns the same pairs as a full rematch, plus the number of rows that had to be rematched
+def MatchAmountPairsDelta(amounts, clearedFlags, cachedAmounts, cachedClearedFlags, cachedPairs):
+    newRows, newCents = OpenAmountCents(amounts, clearedFlags)
+    oldRows, oldCents = OpenAmountCents(cachedAmounts, cachedClearedFlags)
+
+    # Sort both by absolute amount, keeping row order inside each amount group
+    newOrder = np.argsort(np.abs(newCents), kind='stable')
+    oldOrder = np.argsort(np.abs(oldCents), kind='stable')
+    newAbs, newSign, newSorted = np.abs(newCents)[newOrder], newCents[newOrder] > 0, newRows[newOrder]
+    oldAbs, oldSign, oldSorted = np.abs(oldCents)[oldOrder], oldCents[oldOrder] > 0, oldRows[oldOrder]
+    newGroups, newStart, newCount = np.unique(newAbs, return_index=True, return_counts=True)
+    oldGroups, oldStart, oldCount = np.unique(oldAbs, return_index=True, return_counts=True)
+
+    # Amount groups found in both with the same row count are candidates for reuse. Compare their sign sequences element by element
+    _, newIdx, oldIdx = np.intersect1d(newGroups, oldGroups, assume_unique=True, return_indices=True)
+    sameCount = newCount[newIdx] == oldCount[oldIdx]
+    newIdx, oldIdx = newIdx[sameCount], oldIdx[sameCount]
+    groupSizes = newCount[newIdx]
+    rankInGroup = np.arange(groupSizes.sum()) - np.repeat(np.cumsum(groupSizes) - groupSizes, groupSizes)
+    newPos = np.repeat(newStart[newIdx], groupSizes) + rankInGroup
+    oldPos = np.repeat(oldStart[oldIdx], groupSizes) + rankInGroup
+    mismatches = np.bincount(np.repeat(np.arange(len(groupSizes)), groupSizes), weights=newSign[newPos] != oldSign[oldPos], minlength=len(groupSizes))
+    reusedGroup = np.repeat(mismatches == 0, groupSizes)
+
+    # Move the saved pairs of reused groups to their new row positions. Pairs never cross groups, so both rows of a pair map or neither does
+    oldToNewRow = np.full(len(cachedAmounts), -1, dtype=np.int64)
+    oldToNewRow[oldSorted[oldPos[reusedGroup]]] = newSorted[newPos[reusedGroup]]
+    cachedPairs = np.asarray(cachedPairs, dtype=np.int64).reshape(-1, 2)
+    movedPairs = oldToNewRow[cachedPairs]
+    movedPairs = movedPairs[(movedPairs >= 0).all(axis=1)]
+
+    # Rematch everything else
+    rematch = np.ones(len(newRows), dtype=bool)
+    rematch[newOrder[newPos[reusedGroup]]] = False
+    rematchedPairs = MatchCentsVectorized(newRows[rematch], newCents[rematch])
+
+    pairs = np.concatenate((np.sort(movedPairs, axis=1), rematchedPairs))
+    pairOrder = np.argsort(pairs[:, 1], kind='stable')     # Same order as MatchAmountPairs()
+    return pairs[pairOrder], int(rematch.sum())
+
+
+# Parallel version of MatchAmountPairsVectorized() for a single huge statement. Takes the same parameters and returns exactly the same pairs.
+#  A value only ever pairs with its exact negation, so rows are hash-partitioned by absolute amount in cents and each partition is matched on its own
+#  in a worker process. The row positions and cents are handed over in shared memory blocks rather than pickled, and each worker writes the partner
+#  row of every row it matched into a shared partner array. Partitions never share a row, so no locking is needed. The pairs are then rebuilt from
+#  the partner array in original row order. Ref: https://docs.python.org/3/library/multiprocessing.shared_memory.html
+def MatchAmountPairsParallel(amounts, clearedFlags=None, workers=None):
+    workers = workers or os.cpu_count() or 1
+    rowPos, cents = OpenAmountCents(amounts, clearedFlags)
+    partnerRows = np.full(len(amounts), -1, dtype=np.int64)
+    if len(rowPos) > 0:
+        # Several partitions per worker, so a partition with a very common amount doesn't hold up the whole run
+        partitionCount = workers * ParallelPartitionsPerWorker
+        partitionIds = ((np.abs(cents).astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(32)) % np.uint64(partitionCount)    # Multiplicative hash, so nearby amounts spread across partitions
+        order = np.argsort(partitionIds, kind='stable')      # Stable, so row positions stay ascending inside each partition
+        partitionEnds = np.searchsorted(partitionIds[order], np.arange(1, partitionCount + 1, dtype=np.uint64))
+        partitionStarts = np.r_[0, partitionEnds[:-1]]
+
+        sharedBlocks = []
+        try:
+            sharedRows = CreateSharedArray(rowPos[order], sharedBlocks)
+            sharedCents = CreateSharedArray(cents[order], sharedBlocks)
+            sharedPartners = CreateSharedArray(partnerRows, sharedBlocks)
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(MatchPartition, sharedRows, sharedCents, sharedPartners, int(start), int(end))
+                           for start, end in zip(partitionStarts, partitionEnds) if end > start]
+                for future in futures:
+                    future.result()         # Raises here if a worker failed
+            sharedPartnerRows, partnersBlock = AttachSharedArray(sharedPartners)
+            partnerRows[:] = sharedPartnerRows
+            del sharedPartnerRows           # Drop the array view first, otherwise the shared memory block can't be closed
+            partnersBlock.close()
+        finally:
+            for block in sharedBlocks:
+                ReleaseSharedBlock(block)
+
+    # Rebuild the pairs list from the partner array. Each pair shows up at its first row, and is ordered by its second row like MatchAmountPairs()
+    firstRows = np.flatnonzero(partnerRows > np.arange(len(partnerRows)))
+    secondRows = partnerRows[firstRows]
+    pairOrder = np.argsort(secondRows, kind='stable')
+    return np.column_stack((firstRows[pairOrder], secondRows[pairOrder])).astype(np.int64)
+
+
+# Parallel matching worker. Matches the rows in [start, end) of the shared sorted rows/cents arrays and writes partner rows to the shared partner array
+def MatchPartition(sharedRows, sharedCents, sharedPartners, start, end):
+    rowPos, rowsBlock = AttachSharedArray(sharedRows)
+    cents, centsBlock = AttachSharedArray(sharedCents)
+    partnerRows, partnersBlock = AttachSharedArray(sharedPartners)
+    pairs = MatchCentsVectorized(rowPos[start:end].copy(), cents[start:end].copy())
+    partnerRows[pairs[:, 0]] = pairs[:, 1]
+    partnerRows[pairs[:, 1]] = pairs[:, 0]
+    del rowPos, cents, partnerRows      # Drop the array views first, otherwise the shared memory blocks can't be closed
+    rowsBlock.close()
+    centsBlock.close()
+    partnersBlock.close()
+
+
+# Shared memory blocks created by this process and not released yet. A cancelled GUI job releases them on its way out, see CancelJobOnEvent()
+OpenSharedBlocks = set()
+
+
+# Function to copy a NumPy array into a new shared memory block. Returns a small picklable (name, shape, dtype) handle for the worker processes.
+#  The block is added to sharedBlocks, so the caller can release it with ReleaseSharedBlock() when done
+def CreateSharedArray(array, sharedBlocks):
+    block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    sharedBlocks.append(block)
+    OpenSharedBlocks.add(block)
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+    return (block.name, array.shape, array.dtype.str)
+
+
+# Function to close and remove a shared memory block made by CreateSharedArray(). Safe to call twice, eg. from a cancelled job and its own cleanup
+def ReleaseSharedBlock(block):
+    if block not in OpenSharedBlocks:
+        return
+    OpenSharedBlocks.discard(block)
+    try:
+        block.unlink()
+        block.close()
+    except (OSError, BufferError):
+        pass            # Already removed, or an array view is still attached. The block is gone from the system once unlinked
+
+
+# Function to attach to a shared memory block made by CreateSharedArray(). Returns the array view and the block, which the caller must close
+def AttachSharedArray(sharedArray):
+    blockName, shape, dtype = sharedArray
+    block = shared_memory.SharedMemory(name=blockName)
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf), block
+
+
+# Subset-sum matching mode, run on the rows left unmatched by pair matching. Finds a charge netted out by two or more partial reversals (or the
+#  other way round) on the same contract number, and returns each such group as a tuple of row positions. Each contract is searched on its own,
+#  within the SubsetSumMaxRows, SubsetSumMaxGroupRows and SubsetSumGroupTimeLimit bounds. Contracts are shared out over a process pool when there are many
+def MatchSubsetSums(contractNumbers, amounts, clearedFlags, maxRows=None, maxGroupRows=None, groupTimeLimit=None, workers=None):
+    maxRows = maxRows or SubsetSumMaxRows
+    maxGroupRows = maxGroupRows or SubsetSumMaxGroupRows
+    groupTimeLimit = SubsetSumGroupTimeLimit if groupTimeLimit is None else groupTimeLimit
+    rowPos, cents = OpenAmountCents(amounts, clearedFlags)
+
+    # Group the open rows by contract. Only contracts with 3 or more rows of both signs can have a netting group (2 rows would have been a pair)
+    openRows = pd.DataFrame({'contract': np.asarray(contractNumbers, dtype=object)[rowPos], 'row': rowPos, 'cents': cents})
+    groups = []
+    for _, group in openRows.groupby('contract', sort=False):     # Empty contract numbers are dropped by groupby
+        if 3 <= len(group) <= maxGroupRows and (group['cents'] > 0).any() and (group['cents'] < 0).any():
+            groups.append((group['row'].tolist(), group['cents'].tolist()))
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(groups) < SubsetSumParallelMinGroups:
+        return MatchSubsetSumGroups(groups, maxRows, groupTimeLimit)
+    batchSize = -(-len(groups) // (workers * 4))     # Several batches per worker, so one slow batch doesn't hold up the rest. -(-a // b) is ceiling division
+    subsets = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for batchSubsets in executor.map(MatchSubsetSumGroups, [groups[i:i + batchSize] for i in range(0, len(groups), batchSize)], itertools.repeat(maxRows), itertools.repeat(groupTimeLimit)):
+            subsets += batchSubsets
+    return subsets
+
+
+# Subset-sum worker. Searches each (rowPositions, cents) contract group in turn. Within a group, the largest amounts are tried first as the charge,
+#  and each charge is netted against opposite sign rows found by FindSubsetSum(). Rows used in a netting group are not used again
+def MatchSubsetSumGroups(groups, maxRows, groupTimeLimit):
+    subsets = []
+    for rowPositions, groupCents in groups:
+        deadline = time.monotonic() + groupTimeLimit
+        used = [False] * len(rowPositions)
+        for anchor in sorted(range(len(groupCents)), key=lambda i: (-abs(groupCents[i]), i)):
+            if used[anchor]:
+                continue
+            if time.monotonic() > deadline:
+                break
+            anchorCents = groupCents[anchor]
+            candidates = [i for i in range(len(groupCents)) if not used[i] and i != anchor and (groupCents[i] > 0) != (anchorCents > 0) and abs(groupCents[i]) < abs(anchorCents)]
+            found = FindSubsetSum([abs(groupCents[i]) for i in candidates], abs(anchorCents), maxRows - 1, deadline)
+            if found is not None and len(found) >= 2:
+                members = [anchor] + [candidates[i] for i in found]
+                for i in members:
+                    used[i] = True
+                subsets.append(tuple(sorted(rowPositions[i] for i in members)))
+    return subsets
+
+
+# Bounded subset-sum search over integer cents. Finds up to maxItems of the given positive values adding up to exactly target, and returns their indexes
+#  or None. Meet-in-the-middle over combinations: for each item count k, from the fewest up, the values are split into a left combination of k // 2
+#  items and a right one of the rest, with all left indexes below all right indexes so each subset is looked at once. The right combinations are
+#  indexed by sum, keeping the one starting furthest right, and each left combination looks up the sum it's missing. Gives up past the deadline,
+#  or when an index would hold over SubsetSumMaxStates combinations
+def FindSubsetSum(values, target, maxItems, deadline):
+    for itemCount in range(1, min(maxItems, len(values)) + 1):
+        leftCount = itemCount // 2
+        if math.comb(len(values), itemCount - leftCount) > SubsetSumMaxStates:
+            return None
+        rightCombos = {}        # Sum in cents -> right combination of value indexes with that sum, the one with the highest first index
+        for combo in itertools.combinations(range(len(values)), itemCount - leftCount):
+            comboSum = sum(values[i] for i in combo)
+            if comboSum <= target and combo[0] > rightCombos.get(comboSum, (-1,))[0]:
+                rightCombos[comboSum] = combo
+        for leftCombo in itertools.combinations(range(len(values)), leftCount):
+            if time.monotonic() > deadline:
+                return None
+            rightCombo = rightCombos.get(target - sum(values[i] for i in leftCombo))
+            if rightCombo is not None and (not leftCombo or leftCombo[-1] < rightCombo[0]):
+                return leftCombo + rightCombo
+    return None
+
+
+# Function to hash the whole content of a statement file. Read in 1MB blocks, so memory use doesn't depend on the file size. Ref: https://docs.python.org/3/library/hashlib.html#blake2
+def FileContentHash(movementDataFile):
+    contentHash = hashlib.blake2b(digest_size=20)
+    with open(movementDataFile, 'rb') as fp:
+        for block in iter(lambda: fp.read(1024 * 1024), b''):
+            contentHash.update(block)
+    return contentHash.hexdigest()
+
+
+# Function to get the cache folder of a statement. Keyed by the full path of the statement, so amended versions of the same file share the same entry
+def MatchCacheEntryDir(movementDataFile):
+    pathKey = os.path.normcase(os.path.abspath(movementDataFile))
+    return os.path.join(CacheDir, hashlib.sha1(pathKey.encode('utf-8')).hexdigest())
+
+
+# Function to load the saved match state of a statement. Returns a dictionary with 'contentHash', 'frame' and 'pairs', or None if nothing is saved.
+#  The content hash tells if the statement is unchanged, or was amended since the state was saved
+def LoadMatchCache(movementDataFile):
+    entryDir = MatchCacheEntryDir(movementDataFile)
+    try:
+        with open(os.path.join(entryDir, 'meta.json'), 'r') as fp:
+            meta = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    if meta.get('format') != 'parquet':
+        return None         # Saved by an older version as a pickle. Never unpickled, as loading a pickle can run any code put in the file
+    frame = pd.read_parquet(os.path.join(entryDir, 'frame.parquet'))
+    pairs = np.load(os.path.join(entryDir, 'pairs.npy'), allow_pickle=False)
+    os.utime(os.path.join(entryDir, 'meta.json'))      # Mark as recently used for the LRU eviction
+    return {'contentHash': meta['contentHash'], 'frame': frame, 'pairs': pairs}
+
+
+# Function to save the match state of a statement: the parsed frame in Parquet and the pairs as a NumPy array. Raises if the frame can't be saved in
+#  Parquet, ie. no Parquet engine installed or mixed type columns (eg. numbers and text in contract number), and the statement is then not cached.
+#  Written to a temporary folder first and then swapped in, so a failed write never leaves a half written entry behind
+def SaveMatchCache(movementDataFile, contentHash, frame, pairs):
+    entryDir = MatchCacheEntryDir(movementDataFile)
+    tempDir = entryDir + '.tmp' + str(os.getpid())
+    shutil.rmtree(tempDir, ignore_errors=True)
+    os.makedirs(CacheDir, mode=0o700, exist_ok=True)   # Owner only access, where the file system supports it
+    os.makedirs(tempDir)
+    try:
+        frame.to_parquet(os.path.join(tempDir, 'frame.parquet'), index=False)
+        np.save(os.path.join(tempDir, 'pairs.npy'), np.asarray(pairs, dtype=np.int64).reshape(-1, 2))
+        with open(os.path.join(tempDir, 'meta.json'), 'w') as fp:
+            json.dump({'file': os.path.abspath(movementDataFile), 'contentHash': contentHash, 'rows': len(frame), 'format': 'parquet'}, fp, indent=4)
+        shutil.rmtree(entryDir, ignore_errors=True)
+        os.replace(tempDir, entryDir)
+    finally:
+        shutil.rmtree(tempDir, ignore_errors=True)
+    EvictMatchCache()
+
+
+# Function to keep the cache under maxBytes, removing the least recently used statements first
+def EvictMatchCache(maxBytes=None):
+    maxBytes = CacheMaxBytes if maxBytes is None else maxBytes
+    entries = []
+    for entryName in os.listdir(CacheDir):
+        entryDir = os.path.join(CacheDir, entryName)
+        try:
+            lastUsed = os.path.getmtime(os.path.join(entryDir, 'meta.json'))
+            entrySize = sum(os.path.getsize(os.path.join(entryDir, f)) for f in os.listdir(entryDir))
+        except OSError:
+            continue            # Entry being written or removed by another process (batch mode)
+        entries.append((lastUsed, entrySize, entryDir))
+    totalSize = sum(entrySize for _, entrySize, _ in entries)
+    for lastUsed, entrySize, entryDir in sorted(entries):
+        if totalSize <= maxBytes:
+            break
+        shutil.rmtree(entryDir, ignore_errors=True)
+        totalSize -= entrySize
 
 
 # Function to create the amount movement output xlsx file with required formatting
-def Create_Movement_Report(dataFrame):
+#  dataFrame holds the 'contract number' and 'movement total' columns, and clearedMask the cleared flag of each row (eg. MatchState.cleared).
+#  The Absolute Amount formulas and the 'Ok'/'Unmatched' comments are generated as each row is written, so they never exist as columns in memory.
+#  Each data row is written once, with its cell formats chosen from the cleared mask. With constantMemory=True, xlsxwriter flushes
+#  every row to disk as soon as the next row is started, so memory stays flat even on a 1M-row report. Ref: https://xlsxwriter.readthedocs.io/working_with_memory.html
+#  Because rows can't be revisited in constant memory mode, everything is written strictly top to bottom, including the summary note in cell F1.
+#  The report goes to ReportFileName in the current directory, unless another reportFileName is given (batch mode).
+def Create_Movement_Report(dataFrame, clearedMask, constantMemory=True, reportFileName=None):
     try:
-        with pd.ExcelWriter(ReportFileName, engine='xlsxwriter', date_format='d/mm/yyyy') as writer:      # d/mm/yyyy means single digit day is possible as opposed to dd/mm/yyyy
-            workbook = writer.book
+        workbook = xlsxwriter.Workbook(reportFileName or ReportFileName, {'constant_memory': constantMemory, 'default_date_format': 'd/mm/yyyy'})      # d/mm/yyyy means single digit day is possible as opposed to dd/mm/yyyy
+        with workbook:
             sheetName = 'Account movement'
-            dataFrame.to_excel(writer, sheetName, index=False, startrow=2, header=False)
-            # Startrow=2 means row 3 in Excel, header=False to use own header formatting, instead of Pandas default header format. Ref: https://xlsxwriter.readthedocs.io/example_pandas_header_format.html
-            worksheet = writer.sheets[sheetName]
+            worksheet = workbook.add_worksheet(sheetName)
             amountFormat = workbook.add_format({'num_format': '$###,###,##0.00'})
             centreAlignFormat = workbook.add_format({'align': 'center'})
             worksheet.set_column('A:A', 18.43, centreAlignFormat)
@@ -155,25 +1288,29 @@ def Create_Movement_Report(dataFrame):
                 'valign': 'top',
                 'bg_color': '#B4C6E7'})
 
+            # Cleared mask drives the per-row formats and the summary note
+            clearedMask = np.asarray(clearedMask, dtype=bool)
+            unclearedCount = int(len(clearedMask) - clearedMask.sum())     # Counting the number of uncleared items
+
             # Print worksheet header
             rowNum = 0
             cellFormat = workbook.add_format()
             cellFormat.set_font_size(20)
             cellFormat.set_font_color('#006400')    # Green
             cellFormat.set_bold()
-            worksheet.write('A1', 'Account movement', cellFormat)
             worksheet.set_row(rowNum, 25.5)  # Set row height for the header row
+            worksheet.write('A1', 'Account movement', cellFormat)
+            # Print the summary note with uncleared information in cell F1
+            if unclearedCount > 0:
+                worksheet.write('F1', 'Found ' + str(unclearedCount) + ' contracts with unmatched amounts!')    # No cell formatting applied here, because we have already setup a conditional formatting for cell F1 above
 
             # Write the column headers with the defined format.  Using our own header formatting. Ref: https://xlsxwriter.readthedocs.io/example_pandas_header_format.html
             rowNum = 1
-            for col_num, value in enumerate(dataFrame.columns.values):
-                if col_num == 0 or col_num == 1:    # Specific formatting for 'contract number' and 'movement total'
-                    worksheet.write(rowNum, col_num, value, header_format_centre_aligned_green)
-                elif col_num == 2:   # 'Absolute Amount'
-                    worksheet.write(rowNum, col_num, value, header_format_centre_aligned_blue)
-                else:   # Comment (Cleared) column
-                    worksheet.write(rowNum, col_num, 'Comment', header_format_centre_aligned_blue)  # Using title 'Comment' instead of 'Cleared'
             worksheet.set_row(rowNum, 24.75)             # Set row height for the header row
+            for col_num, value in enumerate(MovementColumns):    # Specific formatting for 'contract number' and 'movement total'
+                worksheet.write(rowNum, col_num, value, header_format_centre_aligned_green)
+            worksheet.write(rowNum, 2, 'Absolute Amount', header_format_centre_aligned_blue)
+            worksheet.write(rowNum, 3, 'Comment', header_format_centre_aligned_blue)
 
             # Cell shading formats for items that are not cleared
             uncleared_ContractNo = workbook.add_format({'bg_color': '#F4B084', 'align': 'center'})  # F4B084 is Terracotta shade
@@ -181,27 +1318,30 @@ def Create_Movement_Report(dataFrame):
             uncleared_Comment = workbook.add_format({'bg_color': '#F4B084'})
             cleared_Comment = workbook.add_format({'bg_color': '#C4D79B'})      # C4D79B is Light green shade for cleared comments
 
-            # Re-write data with required cell colour shading for items that are not cleared.
-            # Note, we are not re-writing everything here, but only the cells that require shading. Unshaded (Cleared) cells are filled in by pd function to_excel() above
-            rowOffset = 2
-            for rowIdx, row in dataFrame.iterrows():
-                if dataFrame.at[rowIdx, 'Cleared'] == 'No':  # Check if item is uncleared
-                    for colIdx, cellValue in enumerate(row):
-                        if colIdx == 0:                     # 'contract number' column
-                            worksheet.write(rowIdx+rowOffset, colIdx, cellValue, uncleared_ContractNo)  # Write() function Ref: https://xlsxwriter.readthedocs.io/worksheet.html
-                        elif colIdx == 1 or colIdx == 2:    # 'movement total' and 'Absolute Amount'
-                            worksheet.write(rowIdx+rowOffset, colIdx, cellValue, uncleared_Amount)
-                        else:   # 'Cleared' column data
-                            worksheet.write(rowIdx+rowOffset, colIdx, 'Unmatched', uncleared_Comment)   # Replacing 'No' with 'Unmatched'
-                else:   # Cleared item - green shade the Comment data
-                    for colIdx, cellValue in enumerate(row):
-                        if colIdx == 3:     # 'Cleared' column
-                            worksheet.write(rowIdx+rowOffset, colIdx, 'Ok', cleared_Comment)            # Instead of using 'Yes', we are using 'Ok' for the comment
+            # Write data rows. Cleared rows keep the column formats set above and only get the green 'Ok' comment. Uncleared rows are shaded in full.
+            #  Empty cells (NaN) are written as blanks with the row format, since xlsxwriter can't write NaN as a number
+            contractNumbers = dataFrame['contract number'].tolist()
+            contractMissing = dataFrame['contract number'].isna().tolist()
+            amounts = dataFrame['movement total'].tolist()
+            amountMissing = dataFrame['movement total'].isna().tolist()
+            rowNum = 2      # Data starts at row 3 in Excel
+            for contractNo, isContractMissing, amount, isAmountMissing, isCleared in zip(contractNumbers, contractMissing, amounts, amountMissing, clearedMask.tolist()):
+                if isCleared:
+                    contractFormat, amountCellFormat, comment, commentFormat = None, None, 'Ok', cleared_Comment    # Instead of using 'Yes', we are using 'Ok' for the comment
+                else:
+                    contractFormat, amountCellFormat, comment, commentFormat = uncleared_ContractNo, uncleared_Amount, 'Unmatched', uncleared_Comment  # Replacing 'No' with 'Unmatched'
+                if isContractMissing:
+                    worksheet.write_blank(rowNum, 0, None, contractFormat)
+                else:
+                    worksheet.write(rowNum, 0, contractNo, contractFormat)     # Write() function Ref: https://xlsxwriter.readthedocs.io/worksheet.html
+                if isAmountMissing:
+                    worksheet.write_blank(rowNum, 1, None, amountCellFormat)
+                else:
+                    worksheet.write_number(rowNum, 1, amount, amountCellFormat)
+                worksheet.write_formula(rowNum, 2, '=ABS($B{})'.format(rowNum + 1), amountCellFormat)    # Excel rows count from 1, eg. '=ABS($B3)' on the first data row
+                worksheet.write_string(rowNum, 3, comment, commentFormat)
+                rowNum += 1
 
-            # Print the summary note with uncleared information in cell F1
-            unclearedCount = dataFrame.loc[dataFrame['Cleared'] == 'No', 'Cleared'].count()     # Counting the number of uncleared items. How many rows with Cleared==No?  Ref: https://stackoverflow.com/a/46080857
-            if unclearedCount > 0:
-                worksheet.write('F1', 'Found ' + str(unclearedCount) + ' contracts with unmatched amounts!')    # No cell formatting applied here, because we have already setup a conditional formatting for cell F1 above
             # Activate autofilter on the header. Ref: https://xlsxwriter.readthedocs.io/example_autofilter.html
             worksheet.autofilter('A2:D2')
             # Freeze pane on 2nd row
@@ -211,10 +1351,147 @@ def Create_Movement_Report(dataFrame):
     return
 
 
+# Job engine for the GUI. Each balancing job runs BalanceMovementFile() in its own worker process, with print output and progress values sent back
+#  over a queue. The GUI picks them up with Poll() from its event loop. Start while a job is running queues the next job, Cancel stops the
+#  running job straight away. Each job gets a new queue, so nothing from a cancelled job can show up in the next one. Ref: https://docs.python.org/3/library/multiprocessing.html
+class BalancingJobEngine:
+    CancelTimeout = 5.0             # Seconds a cancelled worker gets to stop its own worker processes and free its shared memory, before it is terminated
+
+    def __init__(self):
+        self.context = multiprocessing.get_context('spawn')    # Same start method on every platform, and no forked copy of the Tk GUI in the worker
+        self.jobWorker = BalancingJobWorker
+        self.process = None
+        self.messages = None
+        self.cancelEvent = None
+        self.currentFile = None
+        self.pendingFiles = deque()
+        self.outMessages = []       # Messages for the next Poll() that didn't come from the worker, eg. 'start' of a job, in the order they happened
+
+    @property
+    def isRunning(self):
+        return self.process is not None
+
+    def Submit(self, movementDataFile):
+        if self.isRunning:
+            self.pendingFiles.append(movementDataFile)
+            print(f'Queued {movementDataFile}, it will start when the current run is done')
+        else:
+            self._StartJob(movementDataFile)
+
+    def Cancel(self):
+        if self.isRunning:
+            cancelledFile = self.currentFile
+            self._StopJob()
+            if self.pendingFiles:
+                self._StartJob(self.pendingFiles.popleft())
+            # Given after any 'start', since the GUI clears the Messages panel on 'start' and this line should stay in view
+            self.outMessages.append(('log', f'\n--> Cancelled: {cancelledFile}. Report file may be incomplete.\n'))
+        elif self.pendingFiles:
+            self.pendingFiles.clear()
+            print('Queued runs cleared')
+
+    # Get the messages since the last call, as a list of (messageType, messageValue) in the order they happened. Types are 'start', 'log' and
+    #  'progress'. Also notices when the job has finished, and starts the next queued job after the finished job's last messages
+    def Poll(self):
+        polledMessages = self.outMessages
+        self.outMessages = []
+        if self.isRunning:
+            processEnded = not self.process.is_alive()      # Checked before draining the queue, so nothing sent just before the end is missed
+            jobDone = False
+            while True:
+                try:
+                    messageType, messageValue = self.messages.get_nowait()
+                except queue.Empty:
+                    break
+                if messageType == 'done':
+                    jobDone = True
+                else:
+                    polledMessages.append((messageType, messageValue))
+            if jobDone or processEnded:
+                self.process.join()
+                if not jobDone:
+                    polledMessages.append(('log', f'\n--> ERROR: Balancing of {self.currentFile} stopped unexpectedly\n'))
+                self._EndJob()
+                if self.pendingFiles:
+                    self._StartJob(self.pendingFiles.popleft())
+        polledMessages += self.outMessages     # 'start' of the next queued job, after the finished job's messages
+        self.outMessages = []
+        return polledMessages
+
+    def Shutdown(self):
+        self.pendingFiles.clear()
+        if self.isRunning:
+            self._StopJob()
+
+    def _StartJob(self, movementDataFile):
+        self.currentFile = movementDataFile
+        self.messages = self.context.Queue()
+        self.cancelEvent = self.context.Event()
+        self.process = self.context.Process(target=self.jobWorker, args=(movementDataFile, ReportFileName, self.messages, self.cancelEvent), daemon=False)    # Not a daemon, since parallel matching starts its own process pool. _StopJob() stops the worker instead
+        self.process.start()
+        self.outMessages.append(('start', movementDataFile))
+
+    # Stop the running job. The worker is asked first, so it can stop its own pool processes and free its shared memory blocks (see
+    #  CancelJobOnEvent()). Terminating it outright would leave those behind. It is only terminated if it doesn't stop within CancelTimeout
+    def _StopJob(self):
+        self.cancelEvent.set()
+        self.process.join(self.CancelTimeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self._EndJob()
+
+    def _EndJob(self):
+        self.process = None
+        self.messages.close()
+        self.messages = None
+        self.cancelEvent = None
+
+
+# Job engine worker, runs in the worker process. Print output goes back to the GUI through the message queue, as does the progress value
+def BalancingJobWorker(movementDataFile, reportFileName, messages, cancelEvent):
+    sys.stdout = sys.stderr = QueueWriter(messages)
+    threading.Thread(target=CancelJobOnEvent, args=(cancelEvent,), daemon=True).start()
+    progress = ProgressTracker(None, lambda progressValue: messages.put(('progress', progressValue)))
+    try:
+        summary = BalanceMovementFile(movementDataFile, reportFileName, progress)
+    except Exception as jobError:
+        print(f'\n--> ERROR: Balancing failed: {jobError!r}')
+        summary = None
+    messages.put(('done', summary))
+
+
+# Job worker thread, waiting for the job to be cancelled. Then frees the shared memory blocks of parallel matching, stops any pool processes the
+#  job has started and ends the worker process, wherever the balancing thread is at
+def CancelJobOnEvent(cancelEvent):
+    cancelEvent.wait()
+    for block in list(OpenSharedBlocks):
+        ReleaseSharedBlock(block)
+    childProcesses = multiprocessing.active_children()     # Includes the process pool workers. Ref: https://docs.python.org/3/library/multiprocessing.html#multiprocessing.active_children
+    for childProcess in childProcesses:
+        childProcess.terminate()
+    for childProcess in childProcesses:
+        childProcess.join(1.0)
+    os._exit(1)
+
+
+# File like object that sends everything written to it to a message queue as 'log' messages. Used as sys.stdout in the job worker process
+class QueueWriter:
+    def __init__(self, messages):
+        self.messages = messages
+
+    def write(self, text):
+        if text:
+            self.messages.put(('log', text))
+        return len(text)
+
+    def flush(self):
+        pass
+
+
 # GUI main
 def mainGUI():
-    global CallCounter
-
+    import PySimpleGUI as sg        # Imported only when the GUI is launched, so the command line, batch, service and library calls don't pay for loading it
     panelDefaultsFileName = 'PanelDefaults.json'
     panelDefaults = {'-FileName-' : os.getcwd() + '\\_AcMovement.xls'}
 
@@ -244,7 +1521,7 @@ def mainGUI():
         # File name input and browse trigger
         [sg.Text('Movement Statement', size=(15,1), pad=(5,(3,15))),
          sg.InputText(panelDefaults['-FileName-'], size=(60,1), key='-FileName-', enable_events=True, pad=(5,(3,15))),
-         sg.FileBrowse(initial_folder=os.getcwd(), key='-FileBrowse-', file_types=(('Excel Files', ('*.xlsx', '*.xls')),('All Files', '*.*')), pad=(5,(3,15)))   # Browsing with init folder Ref: https://github.com/PySimpleGUI/PySimpleGUI/issues/239
+         sg.FileBrowse(initial_folder=os.getcwd(), key='-FileBrowse-', file_types=(('Movement Statements', ('*.xlsx', '*.xls', '*.csv', '*.parquet')),('All Files', '*.*')), pad=(5,(3,15)))   # Browsing with init folder Ref: https://github.com/PySimpleGUI/PySimpleGUI/issues/239
         ],
 
         # Output element inside a frame
@@ -256,6 +1533,7 @@ def mainGUI():
 
         # Buttons
         [sg.Button('Start',              size=(14,2), font='Any 12', pad=((8,5), 3)),  # Pixel padding is used to fine tune around any element.
+         sg.Button('Cancel',             size=(14,2), font='Any 12'),
          sg.Button('Open Excel Report',  size=(17,2), font='Any 12'),                  # ((left,right), (top,bottom)) Default: 5pixels on x-axis and 3pixels on y-axis. Ref: https://pysimplegui.readthedocs.io/en/latest/#pad
          sg.Button('Remove Old Reports', size=(17,2), font='Any 12'),
          sg.Button('Exit',               size=(14,2), font='Any 12')
@@ -264,31 +1542,24 @@ def mainGUI():
 
     # Create the window object
     window = sg.Window('Account Movement', panel_layout, default_element_size=(80, 1), grab_anywhere=False)
-    # Using a thread to run main() as a separate process, so this GUI doesn't freeze up due to long runtime required in main(), which takes more than 15s to complete its operation
-    #  Multi-threading reference: https://pysimplegui.readthedocs.io/en/latest/cookbook/#recipe-long-operations-multi-threading
-    #    Threading doc: https://docs.python.org/3/library/threading.html
-    #    Daemon vs non-daemon threads: https://stackoverflow.com/a/190017
-    mainThread = None
+    # Balancing runs in a separate worker process through the job engine, so this GUI doesn't freeze up on long runs. A thread wasn't enough, since the
+    #  CPU bound matching held the GIL and starved the Tk event loop. A process can also be stopped right away with Cancel.
+    jobEngine = BalancingJobEngine()
     valuesCopy = panelDefaults                  # Initial state of window elements' values will be panelDefaults
 
     # Main event handler loop
     while True:
-        event, values = window.read()           # Read event from window. Buttons are event enabled. Events for other elements enabled (using parameter enable_events) as desired. Ref: https://pysimplegui.readthedocs.io/en/latest/#events
+        event, values = window.read(timeout=100)    # Read event from window. Buttons are event enabled. Events for other elements enabled (using parameter enable_events) as desired. Ref: https://pysimplegui.readthedocs.io/en/latest/#events
+                                                    #  Timeout so the job engine messages below are picked up even when there are no window events. Ref: https://pysimplegui.readthedocs.io/en/latest/#window-read-timeout
         ## Exit button or window close (X) event ##
         if event in (sg.WIN_CLOSED, 'Exit'):    # Checking for window X close button or our own Exit button. Checking of X is prioritised over other events. Doing X abruptly stop compiled EXE execution, eg. doing json dump above this line was crashing compiled EXE when X was clicked.
             break                               #  When X is clicked to close, window object will return None values in 'values', i.e. no dictionary values. event will be None too.
         #print(event, ' --> ', values)          # Debug print
         ## Button events ##
         if event == 'Start':
-            if mainThread == None:              # Check we can create and start a thread. We don't want to create one when is one active. Note, a thread can only be started once, else gives runtime error. Once the thread run is finished, new one has to be created.
-                CallCounter = 0                 # Global CallCounter is used to count # of amount checks. Clear for each run.
-                window.FindElement('-Output-').Update('')   # Clearing the contents of Output element window. Ref: https://github.com/PySimpleGUI/PySimpleGUI/issues/1441#issuecomment-493741474
-                mainThread = threading.Thread(target=main, args=(window,), daemon=True)     # main() set as target, window set as main's parameter
-                mainThread.start()              # Start main() thread
-            elif mainThread.is_alive():         # In case the Start button is clicked multiple while we have an instance of main() thread running, reject subsequent request until thread run is done
-                print('Script already running!')
-            else:
-                pass
+            jobEngine.Submit(values['-FileName-'])      # Starts right away, or is queued to run after the current job
+        if event == 'Cancel':
+            jobEngine.Cancel()                          # Stops the running job. A queued job then starts, otherwise Cancel again clears the queue
         if event == 'Open Excel Report':
             if os.path.isfile(ReportFileName):
                 sysCommand = f'start \"excel\" \"{os.getcwd()}\\{ReportFileName}\"'
@@ -300,18 +1571,26 @@ def mainGUI():
             #  It is to capture all Excel report files except for the current generated file. '?<!' is a negative lookback that excludes the given string, ^ and $ marks start and end of string.
             #  In the pattern created, I have inserted marker '___FILENAME___' to replace it with acutal filename, so we generate a dynamic regex pattern based on current report file name.
             regPattern = '(20\\d\\d-\\d\\d-\\d\\d_Account_Movement\\.xlsx)(?<!^___FILENAME___$)'.replace('___FILENAME___',  ReportFileName.replace('.', '\\.'))     # Also replacing . with \. so file extension dot is taken as literal in regex
+            #  The JSON run report sidecars and any cProfile dumps next to the old reports go with them. Same idea, but a negative lookahead on the current report's base name, as these names vary in length
+            sidecarPattern = '(?!___BASENAME___\\.)20\\d\\d-\\d\\d-\\d\\d_Account_Movement(\\.\\w+)?\\.(json|prof)$'.replace('___BASENAME___', os.path.splitext(ReportFileName)[0])
             try:
                 FilePurge('.\\', regPattern)
+                FilePurge('.\\', sidecarPattern)
             except:
                 print('ERROR: Could not remove old report files! File may be open.')
             else:
                 print('Success: Old report files removed')
 
-        ## Thread call-back events ##
-        if event == '-Thread Done-':            # Call back event from main() to indicate thread run completed
-            mainThread = None                   #  Clear the thread handler - ready to accept another Start
-        if event == '-Progress Value-':         # Call back event from main() to with main script progress value
-            window['-Progressbar-'].Update(values['-Progress Value-'])        # Update current value to progressbar
+        ## Job engine messages ##
+        for messageType, messageValue in jobEngine.Poll():
+            if messageType == 'start':          # A job has started. Clear the output of the previous job
+                window['-Output-'].Update('')   # Clearing the contents of Output element window. Ref: https://github.com/PySimpleGUI/PySimpleGUI/issues/1441#issuecomment-493741474
+                window['-Progressbar-'].Update(0)
+                print(f'Balancing {messageValue}')
+            elif messageType == 'log':          # Print output from the worker process
+                print(messageValue, end='')
+            elif messageType == 'progress':     # Progress value from the worker process
+                window['-Progressbar-'].Update(messageValue)        # Update current value to progressbar
 
         ## File name input text box change events ##
         if event == '-FileName-':                    # File name updated
@@ -323,6 +1602,7 @@ def mainGUI():
             valuesCopy = values   # We do this double backup of values, because when clicking the X button to close the window will yield a None in 'values'. Later when writing to json, we use valuesCopy, which will have valid data
 
     # Closing the GUI window after Exit button or window X is clicked
+    jobEngine.Shutdown()        # Don't leave a worker process running behind a closed window
     window.close()
     sys.stdout = cmdOut     # Restore stdout and stderr since Output GUI element had changed those object pointers to tkinter output
     sys.stderr = cmdErr
@@ -347,6 +1627,7 @@ def FilePurge(dir, pattern):
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()    # Needed for the batch mode process pool in the PyInstaller compiled EXE. Ref: https://docs.python.org/3/library/multiprocessing.html#multiprocessing.freeze_support
     if len(sys.argv) > 1:
         main(sys.argv)      # If there is a parameter given on command line, run main() with that.  eg. C:\>python AcMove.py MovementFile.xls
     else:
@@ -0,0 +1,221 @@
+__author__ = 'sutha75'
+
+# Benchmark harness for the account movement balancer (AcMove.py)
+#  Generates synthetic movement statements of set sizes, match ratios and duplicate amount distributions, then times each stage of the balancing
+#  pipeline on them: ingestion, zero filtering, matching and report writing. Each stage is timed on its own, then run again under tracemalloc to
+#  record its peak memory. Results go to a JSON file, which can be compared with an earlier run to show speedups and catch regressions.
+#
+#  eg. C:\>python AcMove_Benchmark.py --sizes 1k,100k,1M --engines hash,vectorized --out bench_v2.json --compare bench_v1.json
+
+import AcMove
+import pandas as pd
+import numpy as np
+import sys, os
+import argparse
+import json
+import platform
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+## Configs & globals ##
+RegressionTolerance = 1.20          # A stage counts as a regression when it is this many times slower than in the compared results
+RegressionMinSeconds = 0.05         # Stages faster than this in both runs are too noisy to call a regression, and are only shown
+StageRepeats = 3                    # Timed runs per stage after one warm-up run. The fastest time is kept, being the least disturbed by other load
+
+
+# Function to generate a synthetic movement statement as a dataframe with 'contract number' and 'movement total' columns.
+#  rows:         number of statement rows
+#  matchRatio:   share of rows that are laid out as +ve/-ve pairs netting to zero. The rest get a random amount and sign, so a few may still match by chance
+#  zeroRatio:    share of rows with a zero amount
+#  distribution: how amounts repeat across the statement
+#                'unique'  - almost every pair has its own amount
+#                'uniform' - amounts drawn evenly from a pool of rows // 20 values, so each amount shows up about 20 times
+#                'zipf'    - amounts drawn from the same pool with a Zipf skew, so a few amounts are very common (eg. standard fees)
+def GenerateStatement(rows, matchRatio=0.9, zeroRatio=0.02, distribution='uniform', seed=0):
+    rng = np.random.default_rng(seed)
+    zeroRows = int(rows * zeroRatio)
+    pairCount = int((rows - zeroRows) * matchRatio) // 2
+    loneRows = rows - zeroRows - 2 * pairCount
+
+    # Amount pool in cents, from $0.01 to $99,999.99
+    poolSize = max(1, rows if distribution == 'unique' else rows // 20)
+    amountPool = rng.integers(1, 10000000, size=poolSize)
+
+    def DrawAmounts(count):
+        if distribution == 'zipf':
+            poolIdx = np.minimum(rng.zipf(1.3, size=count) - 1, poolSize - 1)
+        else:
+            poolIdx = rng.integers(0, poolSize, size=count)
+        return amountPool[poolIdx]
+
+    pairAmounts = DrawAmounts(pairCount)
+    cents = np.concatenate((pairAmounts, -pairAmounts, DrawAmounts(loneRows) * rng.choice([-1, 1], size=loneRows), np.zeros(zeroRows, dtype=np.int64)))
+    rng.shuffle(cents)      # Spread the pairs across the statement, the way they are on a real statement
+
+    contractCount = max(1, rows // 3)
+    contractNumbers = np.char.add('C', rng.integers(0, contractCount, size=rows).astype(str))
+    return pd.DataFrame({'contract number': contractNumbers, 'movement total': cents / 100.0})
+
+
+# Function to write a generated statement in the given input format, laid out like the bank export: a title row above the column headers
+def WriteStatement(statement, fileName, fileFormat):
+    if fileFormat == 'xlsx':
+        with pd.ExcelWriter(fileName, engine='xlsxwriter') as writer:
+            statement.to_excel(writer, sheet_name='Movement', index=False, startrow=1)
+    elif fileFormat == 'parquet':
+        statement.to_parquet(fileName, index=False)
+    else:
+        statement.to_csv(fileName, index=False)
+
+
+# Function to run one stage. Runs it once to warm up (imports, caches, pool start), then times it repeats times and keeps the fastest, so a single
+#  slow sample doesn't show up as a regression. Then runs it again under tracemalloc to record its peak memory, since tracing slows Python code down.
+#  Returns the stage result dictionary and the value returned by the stage function
+def RunStage(stageFunction, traceMemory, repeats=None):
+    repeats = repeats or StageRepeats
+    stageResult = stageFunction()
+    wallSamples = []
+    cpuSamples = []
+    for _ in range(repeats):
+        startWall = time.perf_counter()
+        startCpu = time.process_time()
+        stageFunction()
+        wallSamples.append(time.perf_counter() - startWall)
+        cpuSamples.append(time.process_time() - startCpu)
+    stage = {'seconds': min(wallSamples), 'cpuSeconds': min(cpuSamples), 'samples': wallSamples, 'peakBytes': None}
+    if traceMemory:
+        tracemalloc.start()
+        try:
+            stageFunction()
+            stage['peakBytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return stage, stageResult
+
+
+# Function to benchmark the pipeline on one generated statement, for each matching engine asked for
+def BenchmarkCase(rows, matchRatio, distribution, fileFormat, engines, workDir, traceMemory, seed, repeats=None):
+    caseName = f'{rows}-{distribution}-{matchRatio}-{fileFormat}'
+    print(f'--> {caseName}: generating statement...')
+    statement = GenerateStatement(rows, matchRatio, distribution=distribution, seed=seed)
+    inputFile = os.path.join(workDir, f'statement_{rows}.{fileFormat}')
+    WriteStatement(statement, inputFile, fileFormat)
+    del statement
+
+    stages = {}
+    stages['ingest'], df = RunStage(lambda: AcMove.ReadMovementFile(inputFile), traceMemory, repeats)
+    stages['zeroFilter'], zeroFlags = RunStage(lambda: AcMove.ZeroAmountMask(df['movement total']), traceMemory, repeats)
+    amounts = df['movement total'].to_numpy(dtype=np.float64)
+
+    results = []
+    for engine in engines:
+        print(f'\t{engine} engine...')
+        engineStages = dict(stages)
+        if engine == 'hash':
+            matchFunction = lambda: AcMove.MatchAmountPairs(amounts.tolist(), zeroFlags.tolist())
+        elif engine == 'parallel':
+            matchFunction = lambda: AcMove.MatchAmountPairsParallel(amounts, zeroFlags)
+        else:
+            matchFunction = lambda: AcMove.MatchAmountPairsVectorized(amounts, zeroFlags)
+        engineStages['match'], pairs = RunStage(matchFunction, traceMemory and engine != 'parallel', repeats)    # Worker process memory isn't visible to tracemalloc
+
+        clearedFlags = zeroFlags.copy()
+        clearedFlags[np.asarray(pairs, dtype=np.int64).reshape(-1)] = True
+        if rows + 2 <= AcMove.ExcelMaxRows:
+            reportFile = os.path.join(workDir, 'report.xlsx')
+            engineStages['report'], _ = RunStage(lambda: AcMove.Create_Movement_Report(df, clearedFlags, reportFileName=reportFile), traceMemory, repeats)
+        else:
+            engineStages['report'] = None   # Doesn't fit in an Excel sheet
+
+        results.append({'case': caseName, 'rows': rows, 'matchRatio': matchRatio, 'distribution': distribution, 'format': fileFormat, 'engine': engine,
+                        'matchedRows': 2 * len(pairs), 'unmatchedRows': int(len(clearedFlags) - clearedFlags.sum()), 'stages': engineStages})
+    return results
+
+
+# Function to compare results against an earlier results file. Prints the speedup per stage and returns the list of regressions found.
+#  Stages under RegressionMinSeconds in both runs are never counted as regressions, as timer noise alone can make them 1.2x slower
+def CompareResults(results, previousFile):
+    with open(previousFile, 'r') as fp:
+        previous = {(r['case'], r['engine']): r for r in json.load(fp)['results']}
+    regressions = []
+    print(f'\n--> Compared with {previousFile} (speedup = previous time / current time):\n')
+    for result in results:
+        before = previous.get((result['case'], result['engine']))
+        if before is None:
+            continue
+        speedups = []
+        for stageName, stage in result['stages'].items():
+            beforeStage = before['stages'].get(stageName)
+            if stage is None or beforeStage is None or stage['seconds'] <= 0:
+                continue
+            speedup = beforeStage['seconds'] / stage['seconds']
+            speedups.append(f'{stageName} {speedup:.2f}x')
+            if speedup < 1 / RegressionTolerance and max(stage['seconds'], beforeStage['seconds']) >= RegressionMinSeconds:
+                regressions.append(f"{result['case']} {result['engine']} {stageName}: {beforeStage['seconds']:.3f}s -> {stage['seconds']:.3f}s")
+        print(f"\t{result['case']} {result['engine']}: " + ', '.join(speedups))
+    for regression in regressions:
+        print(f'\tREGRESSION: {regression}')
+    return regressions
+
+
+# Function to read a row count such as 1000, 10k or 5M
+def ParseSize(sizeText):
+    multipliers = {'k': 1000, 'm': 1000000}
+    sizeText = sizeText.strip().lower()
+    if sizeText[-1] in multipliers:
+        return int(float(sizeText[:-1]) * multipliers[sizeText[-1]])
+    return int(sizeText)
+
+
+# Benchmark main
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the account movement balancer on synthetic statements')
+    parser.add_argument('--sizes', default='1k,10k,100k', help='Comma separated row counts, eg. 1k,100k,1M,5M')
+    parser.add_argument('--match-ratios', default='0.9', help='Comma separated shares of rows laid out as matching pairs')
+    parser.add_argument('--distributions', default='uniform', help='Comma separated amount distributions: unique, uniform, zipf')
+    parser.add_argument('--format', default='csv', choices=['csv', 'parquet', 'xlsx'], help='Input statement format')
+    parser.add_argument('--engines', default='hash,vectorized', help='Comma separated matching engines: hash, vectorized, parallel')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the tracemalloc peak memory runs')
+    parser.add_argument('--repeats', type=int, default=StageRepeats, help='Timed runs per stage after a warm-up run. The fastest is kept')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='AcMove_Benchmark.json', help='JSON results file')
+    parser.add_argument('--compare', help='Earlier JSON results file to compare with. Exits with code 1 on a regression')
+    args = parser.parse_args(argv[1:])
+
+    sizes = [ParseSize(s) for s in args.sizes.split(',')]
+    if args.format == 'xlsx' and max(sizes) + 2 > AcMove.ExcelMaxRows:
+        print(f'\tERROR: xlsx input is limited to {AcMove.ExcelMaxRows - 2:,d} rows, use csv or parquet for larger sizes')
+        return 2
+
+    results = []
+    with tempfile.TemporaryDirectory() as workDir:
+        for rows in sizes:
+            for matchRatio in [float(r) for r in args.match_ratios.split(',')]:
+                for distribution in args.distributions.split(','):
+                    results += BenchmarkCase(rows, matchRatio, distribution, args.format, args.engines.split(','), workDir, not args.no_memory, args.seed, args.repeats)
+
+    # Results summary
+    print('\n--> Results (seconds, peak MB):\n')
+    for result in results:
+        stageText = []
+        for stageName, stage in result['stages'].items():
+            if stage is not None:
+                peakText = '' if stage['peakBytes'] is None else ' / {:.1f}MB'.format(stage['peakBytes'] / 1e6)
+                stageText.append('{} {:.3f}s{}'.format(stageName, stage['seconds'], peakText))
+        print(f"\t{result['case']} {result['engine']}: " + ', '.join(stageText))
+
+    with open(args.out, 'w') as fp:
+        json.dump({'timestamp': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(), 'pandas': pd.__version__,
+                   'numpy': np.__version__, 'platform': platform.platform(), 'cpuCount': os.cpu_count(), 'results': results}, fp, indent=4)
+    print(f'\n--> Results written to {args.out}')
+
+    if args.compare:
+        if CompareResults(results, args.compare):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,415 @@
+__author__ = 'sutha75'
+
+# Tests for the account movement balancer (AcMove.py) matching engines. Run with eg. C:\>python -m pytest -q
+#  Every engine is checked against the original iterrows double loop, kept here as DoubleLoopPairs(), on random statements with
+#  repeated amounts, zero amounts, empty (NaN) amounts and the ±0.005 near zero boundary
+
+import AcMove
+import pandas as pd
+import numpy as np
+import pytest
+import itertools
+import asyncio
+import os
+import json
+import time
+
+
+# The original double loop from main(), on a plain list of amounts. Each uncleared row is paired with the first other uncleared row netting to zero
+#  within ±0.001. Returns the pairs as (firstRowPos, secondRowPos) tuples ordered by second row, same as MatchAmountPairs()
+def DoubleLoopPairs(amounts, clearedFlags):
+    cleared = list(clearedFlags)
+    pairs = []
+    for i in range(len(amounts)):
+        if not cleared[i]:
+            for j in range(len(amounts)):
+                if not cleared[j] and -0.001 < amounts[i] + amounts[j] < 0.001:
+                    cleared[i] = cleared[j] = True
+                    pairs.append((min(i, j), max(i, j)))
+                    break
+    return sorted(pairs, key=lambda pair: pair[1])
+
+
+# Random statement amounts in whole cents from a small pool, so amounts repeat with both signs, plus zero, NaN and ±0.005 rows
+def RandomAmounts(rng, rows):
+    amounts = rng.choice([-1, 1], size=rows) * rng.integers(1, 12, size=rows) * 1.15
+    specialRows = rng.random(rows)
+    amounts[specialRows < 0.05] = 0.0
+    amounts[(specialRows >= 0.05) & (specialRows < 0.10)] = np.nan
+    amounts[(specialRows >= 0.10) & (specialRows < 0.13)] = 0.005
+    amounts[(specialRows >= 0.13) & (specialRows < 0.16)] = -0.005
+    return np.round(amounts, 3)
+
+
+def ClearedFlags(amounts):
+    return AcMove.ZeroAmountMask(pd.Series(amounts))
+
+
+def AsPairList(pairs):
+    return [tuple(pair) for pair in np.asarray(pairs, dtype=np.int64).reshape(-1, 2).tolist()]
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_hash_engine_matches_double_loop(seed):
+    amounts = RandomAmounts(np.random.default_rng(seed), 200)
+    clearedFlags = ClearedFlags(amounts)
+    expected = DoubleLoopPairs(amounts.tolist(), clearedFlags.tolist())
+    assert AsPairList(AcMove.MatchAmountPairs(amounts.tolist(), clearedFlags.tolist())) == expected
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_vectorized_engine_matches_double_loop(seed):
+    amounts = RandomAmounts(np.random.default_rng(seed), 200)
+    clearedFlags = ClearedFlags(amounts)
+    expected = DoubleLoopPairs(amounts.tolist(), clearedFlags.tolist())
+    assert AsPairList(AcMove.MatchAmountPairsVectorized(amounts, clearedFlags)) == expected
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_parallel_engine_matches_double_loop(seed):
+    amounts = RandomAmounts(np.random.default_rng(seed), 300)
+    clearedFlags = ClearedFlags(amounts)
+    expected = DoubleLoopPairs(amounts.tolist(), clearedFlags.tolist())
+    assert AsPairList(AcMove.MatchAmountPairsParallel(amounts, clearedFlags, workers=2)) == expected
+
+
+def test_stream_matcher_chunks_match_single_feed():
+    amounts = RandomAmounts(np.random.default_rng(7), 500)
+    clearedFlags = ClearedFlags(amounts)
+    matcher = AcMove.PairMatcher()
+    for start in range(0, len(amounts), 64):
+        matcher.Feed(amounts[start:start + 64].tolist(), clearedFlags[start:start + 64].tolist())
+    assert matcher.pairs == AcMove.MatchAmountPairs(amounts.tolist(), clearedFlags.tolist())
+
+
+def test_empty_and_half_cent_rows():
+    amounts = [np.nan, 0.005, 12.50, np.nan, -0.005, -12.50, 0.004, -0.004, 0.005, 0.005]     # The last two half cents must not net each other out
+    clearedFlags = ClearedFlags(amounts)
+    assert clearedFlags.tolist() == [False, False, False, False, False, False, True, True, False, False]
+    assert AsPairList(AcMove.MatchAmountPairs(amounts, clearedFlags.tolist())) == [(1, 4), (2, 5)]
+    assert AsPairList(AcMove.MatchAmountPairsVectorized(amounts, clearedFlags)) == [(1, 4), (2, 5)]
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_delta_rematch_matches_full_rematch(seed):
+    rng = np.random.default_rng(seed)
+    cachedAmounts = RandomAmounts(rng, 200)
+    cachedClearedFlags = ClearedFlags(cachedAmounts)
+    cachedPairs = AcMove.MatchAmountPairsVectorized(cachedAmounts, cachedClearedFlags)
+
+    # Amend the statement: change a few amounts, drop a few rows and append a few new ones
+    amounts = cachedAmounts.copy()
+    changedRows = rng.choice(len(amounts), size=10, replace=False)
+    amounts[changedRows] = RandomAmounts(rng, 10)
+    amounts = np.concatenate((np.delete(amounts, rng.choice(len(amounts), size=5, replace=False)), RandomAmounts(rng, 15)))
+    clearedFlags = ClearedFlags(amounts)
+
+    pairs, rematchedRows = AcMove.MatchAmountPairsDelta(AcMove.MovementCents(amounts), clearedFlags, cachedAmounts, cachedClearedFlags, cachedPairs)
+    assert AsPairList(pairs) == AsPairList(AcMove.MatchAmountPairsVectorized(amounts, clearedFlags))
+    assert rematchedRows <= len(amounts)
+
+
+def test_delta_rematch_of_unchanged_statement_reuses_all_pairs():
+    amounts = RandomAmounts(np.random.default_rng(3), 200)
+    clearedFlags = ClearedFlags(amounts)
+    cachedPairs = AcMove.MatchAmountPairsVectorized(amounts, clearedFlags)
+    pairs, rematchedRows = AcMove.MatchAmountPairsDelta(AcMove.MovementCents(amounts), clearedFlags, amounts, clearedFlags, cachedPairs)
+    assert AsPairList(pairs) == AsPairList(cachedPairs)
+    assert rematchedRows == 0
+
+
+def test_statement_over_excel_row_limit_gets_no_report(tmp_path, monkeypatch):
+    monkeypatch.setattr(AcMove, 'ExcelMaxRows', 5)
+    reportFile = str(tmp_path / 'Report.xlsx')
+    result = AcMove.balance(pd.DataFrame({'contract number': [1, 2, 3, 4], 'movement total': [1.0, -1.0, 2.0, 3.0]}), {'report': reportFile})
+    assert result['error'] == 'Statement too large for an Excel report'
+    assert result['unmatched'] == 2
+    assert not (tmp_path / 'Report.xlsx').exists()
+
+
+def test_existing_file_with_pattern_characters_is_not_a_batch(tmp_path):
+    statementFile = tmp_path / 'Statement [June].xls'
+    statementFile.write_bytes(b'')
+    assert not AcMove.IsBatchInput(str(statementFile))
+    assert AcMove.IsBatchInput(str(tmp_path / '*.xls'))
+    assert AcMove.IsBatchInput(str(tmp_path))
+
+
+def test_batch_report_names_differ_by_input_file_type():
+    assert AcMove.BatchReportFileName('s0.csv', 'out') != AcMove.BatchReportFileName('s0.parquet', 'out')
+
+
+def test_match_cache_hit_and_delta_give_the_same_pairs(tmp_path, monkeypatch):
+    pytest.importorskip('pyarrow')
+    monkeypatch.setattr(AcMove, 'CacheDir', str(tmp_path / 'cache'))
+    statementFile = tmp_path / 'Statement.csv'
+    amounts = RandomAmounts(np.random.default_rng(5), 300)
+    pd.DataFrame({'contract number': np.arange(300), 'movement total': amounts}).to_csv(statementFile, index=False)
+    assert AcMove.balance(str(statementFile))['engine'] == 'hash'
+    result = AcMove.balance(str(statementFile))
+    assert result['engine'] == 'cache'
+    assert AsPairList(result['pairs']) == AsPairList(AcMove.balance(str(statementFile), {'useCache': False})['pairs'])
+
+    amounts[:20] = RandomAmounts(np.random.default_rng(6), 20)
+    pd.DataFrame({'contract number': np.arange(300), 'movement total': amounts}).to_csv(statementFile, index=False)
+    result = AcMove.balance(str(statementFile))
+    assert result['engine'] == 'delta'
+    assert AsPairList(result['pairs']) == AsPairList(AcMove.balance(str(statementFile), {'useCache': False})['pairs'])
+
+
+def test_subset_sum_finds_the_fewest_items_like_brute_force():
+    rng = np.random.default_rng(11)
+    for _ in range(2000):
+        values = rng.integers(1, 30, size=rng.integers(1, 9)).tolist()
+        target = int(rng.integers(1, 60))
+        found = AcMove.FindSubsetSum(values, target, 3, float('inf'))
+        fewest = next((k for k in range(1, 4) if any(sum(c) == target for c in itertools.combinations(values, k))), None)
+        if fewest is None:
+            assert found is None
+        else:
+            assert len(found) == fewest and len(set(found)) == fewest and sum(values[i] for i in found) == target
+
+
+def test_subset_sum_nets_a_charge_reached_late_in_the_search():
+    groups = [([0, 1, 2, 3, 4, 5], [-2400, 300, 200, 1000, 500, 900])]
+    assert AcMove.MatchSubsetSumGroups(groups, 4, 1.0) == [(0, 3, 4, 5)]
+
+
+def test_service_only_listens_on_loopback():
+    assert AcMove.IsLoopbackHost('127.0.0.1') and AcMove.IsLoopbackHost('localhost') and AcMove.IsLoopbackHost('::1')
+    assert not AcMove.IsLoopbackHost('0.0.0.0') and not AcMove.IsLoopbackHost('192.168.1.10')
+
+
+def test_service_turns_away_a_non_object_body():
+    service = AcMove.BalancingService(1)
+    try:
+        assert asyncio.run(service.Route('POST', '/balance', b'[1, 2]'))[0] == 400
+    finally:
+        service.Shutdown()
+
+
+def test_progress_tracker_throttles_reports_and_finishes_on_100():
+    reported = []
+    progress = AcMove.ProgressTracker(1000, reported.append, minStep=10, minInterval=3600)
+    for processedRows in range(1, 1001):
+        progress.Update(processedRows, 0)
+    assert reported == list(range(0, 101, 10))
+    progress.Finish(matchedRows=500)
+    assert reported[-1] == 100 and reported.count(100) == 1
+    assert progress.matchedRows == 500 and progress.remainingRows == 500
+
+    reported.clear()
+    progress = AcMove.ProgressTracker(1000, reported.append, minStep=10, minInterval=3600)
+    progress.Update(999, 0)
+    progress.Finish(matchedRows=0)
+    assert reported == [99, 100]
+
+
+def test_movement_report_cells_formulas_fills_and_note(tmp_path):
+    openpyxl = pytest.importorskip('openpyxl')
+    reportFile = str(tmp_path / 'Report.xlsx')
+    df = pd.DataFrame({'contract number': [101, 102, 103, 104], 'movement total': [5.0, np.nan, -5.0, 7.25]})
+    AcMove.Create_Movement_Report(df, [True, False, True, False], reportFileName=reportFile)
+
+    worksheet = openpyxl.load_workbook(reportFile).active
+    Fill = lambda cell: cell.fill.fgColor.rgb if cell.fill.fill_type else None
+    assert worksheet['A1'].value == 'Account movement'
+    assert worksheet['F1'].value == 'Found 2 contracts with unmatched amounts!'
+    assert [cell.value for cell in worksheet[2]][:4] == ['contract number', 'movement total', 'Absolute Amount', 'Comment']
+    rows = [[cell.value for cell in row][:4] for row in worksheet.iter_rows(min_row=3)]
+    assert rows == [[101, 5, '=ABS($B3)', 'Ok'], [102, None, '=ABS($B4)', 'Unmatched'], [103, -5, '=ABS($B5)', 'Ok'], [104, 7.25, '=ABS($B6)', 'Unmatched']]
+    assert [Fill(cell) for cell in worksheet[3]][:4] == [None, None, None, 'FFC4D79B']
+    assert [Fill(cell) for cell in worksheet[4]][:4] == ['FFF4B084'] * 4
+    assert worksheet.freeze_panes == 'A3' and worksheet.auto_filter.ref == 'A2:D2'
+
+
+def test_movement_report_without_unmatched_rows_has_no_note(tmp_path):
+    openpyxl = pytest.importorskip('openpyxl')
+    reportFile = str(tmp_path / 'Report.xlsx')
+    AcMove.Create_Movement_Report(pd.DataFrame({'contract number': [1, 2], 'movement total': [3.0, -3.0]}), [True, True], reportFileName=reportFile)
+    assert openpyxl.load_workbook(reportFile).active['F1'].value is None
+
+
+def test_streamed_xls_gives_the_same_frame_as_whole_file_read():
+    pytest.importorskip('xlrd')
+    sampleFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), '_AcMovement.xls')
+    wholeFile = AcMove.ReadMovementFile(sampleFile)
+    streamed = pd.concat(AcMove.ReadMovementChunks(sampleFile, chunkRows=500), ignore_index=True)
+    pd.testing.assert_frame_equal(streamed, wholeFile)
+
+
+def test_benchmark_ignores_slowdowns_below_the_noise_floor(tmp_path):
+    import AcMove_Benchmark
+    Result = lambda matchSeconds, reportSeconds: {'case': 'c', 'engine': 'hash', 'stages': {'match': {'seconds': matchSeconds}, 'report': {'seconds': reportSeconds}}}
+    previousFile = tmp_path / 'previous.json'
+    previousFile.write_text(json.dumps({'results': [Result(0.002, 1.0)]}))
+    regressions = AcMove_Benchmark.CompareResults([Result(0.004, 1.5)], str(previousFile))
+    assert len(regressions) == 1 and 'report' in regressions[0]
+
+
+# GUI job engine workers for the tests below. They run in a spawned process, so the settings are made there rather than with monkeypatch
+def NoCacheJobWorker(movementDataFile, reportFileName, messages, cancelEvent):
+    AcMove.UseMatchCache = False
+    AcMove.BalancingJobWorker(movementDataFile, reportFileName, messages, cancelEvent)
+
+
+def StuckParallelJobWorker(movementDataFile, reportFileName, messages, cancelEvent):
+    AcMove.UseMatchCache = False
+    AcMove.ParallelModeMinRows = 1
+    AcMove.MatchPartition = StuckMatchPartition
+    AcMove.BalancingJobWorker(movementDataFile, reportFileName, messages, cancelEvent)
+
+
+def StuckMatchPartition(*args):
+    time.sleep(120)
+
+
+def PollJobs(jobEngine, timeout=60):
+    jobMessages = []
+    deadline = time.monotonic() + timeout
+    while jobEngine.isRunning and time.monotonic() < deadline:
+        jobMessages += jobEngine.Poll()
+        time.sleep(0.05)
+    return jobMessages + jobEngine.Poll()
+
+
+def WriteSmallStatement(fileName):
+    pd.DataFrame({'contract number': [1, 2, 3], 'movement total': [4.0, -4.0, 5.0]}).to_csv(fileName, index=False)
+
+
+def test_job_engine_gives_a_finished_jobs_messages_before_the_next_start(tmp_path, monkeypatch):
+    monkeypatch.setattr(AcMove, 'ReportFileName', str(tmp_path / 'Report.xlsx'))
+    firstFile, secondFile = str(tmp_path / 'first.csv'), str(tmp_path / 'second.csv')
+    WriteSmallStatement(firstFile)
+    WriteSmallStatement(secondFile)
+    jobEngine = AcMove.BalancingJobEngine()
+    jobEngine.jobWorker = NoCacheJobWorker
+    try:
+        jobEngine.Submit(firstFile)
+        jobEngine.Submit(secondFile)
+        jobMessages = PollJobs(jobEngine)
+    finally:
+        jobEngine.Shutdown()
+    starts = [i for i, message in enumerate(jobMessages) if message[0] == 'start']
+    assert [jobMessages[i][1] for i in starts] == [firstFile, secondFile]
+    firstJobMessages = jobMessages[starts[0]:starts[1]]
+    assert ('progress', 100) in firstJobMessages
+    assert 'Success' in ''.join(value for messageType, value in firstJobMessages if messageType == 'log')
+    assert 'Success' in ''.join(value for messageType, value in jobMessages[starts[1]:] if messageType == 'log')
+
+
+def ChildPids(parentPid):
+    childPids = []
+    for procDir in os.listdir('/proc'):
+        try:
+            with open(f'/proc/{procDir}/stat') as fp:
+                stat = fp.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(stat[1]) == parentPid:
+            childPids.append(int(procDir))
+    return childPids
+
+
+def IsProcessAlive(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as fp:
+            return fp.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except OSError:
+        return False
+
+
+@pytest.mark.skipif(not os.path.isdir('/dev/shm') or not os.path.isdir('/proc'), reason='Needs /proc and /dev/shm to look for left over processes and shared memory')
+def test_cancelled_parallel_job_leaves_no_processes_or_shared_memory(tmp_path, monkeypatch):
+    monkeypatch.setattr(AcMove, 'ReportFileName', str(tmp_path / 'Report.xlsx'))
+    statementFile = str(tmp_path / 'statement.csv')
+    WriteSmallStatement(statementFile)
+    sharedBlocksBefore = set(os.listdir('/dev/shm'))
+    jobEngine = AcMove.BalancingJobEngine()
+    jobEngine.jobWorker = StuckParallelJobWorker
+    try:
+        jobEngine.Submit(statementFile)
+        workerPid = jobEngine.process.pid
+        deadline = time.monotonic() + 60
+        while not (set(os.listdir('/dev/shm')) - sharedBlocksBefore and ChildPids(workerPid)) and time.monotonic() < deadline:
+            time.sleep(0.05)     # Wait until parallel matching has its shared memory and pool processes
+        time.sleep(0.5)
+        poolPids = ChildPids(workerPid)
+        assert poolPids and set(os.listdir('/dev/shm')) - sharedBlocksBefore
+        jobEngine.Cancel()
+        jobMessages = jobEngine.Poll()
+    finally:
+        jobEngine.Shutdown()
+    assert not jobEngine.isRunning
+    assert any('Cancelled' in value for messageType, value in jobMessages if messageType == 'log')
+    deadline = time.monotonic() + 10
+    while any(IsProcessAlive(pid) for pid in poolPids) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not any(IsProcessAlive(pid) for pid in poolPids)
+    assert not {f for f in set(os.listdir('/dev/shm')) - sharedBlocksBefore if f.startswith('psm_')}
+
+
+def test_service_turns_away_options_that_are_not_an_object():
+    service = AcMove.BalancingService(1)
+    try:
+        assert asyncio.run(service.Route('POST', '/balance', b'{"file": "s.csv", "options": [1]}'))[0] == 400
+    finally:
+        service.Shutdown()
+
+
+def test_service_replies_500_when_routing_fails():
+    class BrokenService(AcMove.BalancingService):
+        async def Route(self, method, path, body):
+            raise RuntimeError('cannot schedule new futures after shutdown')
+
+    class Writer:
+        def __init__(self):
+            self.data = b''
+        def write(self, data):
+            self.data += data
+        async def drain(self):
+            pass
+        def close(self):
+            pass
+
+    async def Run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(b'GET /health HTTP/1.1\r\n\r\n')
+        reader.feed_eof()
+        writer = Writer()
+        service = BrokenService(1)
+        try:
+            await service.HandleConnection(reader, writer)
+        finally:
+            service.Shutdown()
+        return writer.data
+
+    reply = asyncio.run(Run())
+    assert reply.startswith(b'HTTP/1.1 500 ') and b'RuntimeError' in reply
+
+
+def test_run_report_writes_the_stage_table_to_a_json_sidecar(tmp_path):
+    reportFile = str(tmp_path / 'Report.xlsx')
+    runReport = AcMove.RunReport('Statement.csv', reportFile)
+    with runReport.Stage('read') as stage:
+        stage['rows'] = 3
+    with runReport.Stage('matching', 2):
+        pass
+    runReport.summary['engine'] = 'hash'
+    runReport.Finish()
+
+    with open(str(tmp_path / 'Report.json')) as fp:
+        sidecar = json.load(fp)
+    assert sidecar['file'] == 'Statement.csv' and sidecar['report'] == reportFile and sidecar['engine'] == 'hash'
+    assert [(stage['stage'], stage['rows']) for stage in sidecar['stages']] == [('read', 3), ('matching', 2)]
+    assert all(stage['wallSeconds'] >= 0 and stage['cpuSeconds'] >= 0 for stage in sidecar['stages'])
+    assert sidecar['seconds'] >= sum(stage['wallSeconds'] for stage in sidecar['stages'])
+
+
+def test_balance_run_summary_matches_its_sidecar(tmp_path):
+    reportFile = str(tmp_path / 'Report.xlsx')
+    result = AcMove.balance(pd.DataFrame({'contract number': [1, 2, 3], 'movement total': [4.0, -4.0, 5.0]}), {'report': reportFile})
+    with open(str(tmp_path / 'Report.json')) as fp:
+        sidecar = json.load(fp)
+    assert (sidecar['rows'], sidecar['matched'], sidecar['unmatched'], sidecar['error']) == (result['rows'], result['matched'], result['unmatched'], None) == (3, 2, 1, None)
+    assert [stage['stage'] for stage in sidecar['stages']] == ['read', 'zero clearing', 'matching', 'report writing']